@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from route_logs import CONGESTION_CLASSES, classify_delay, find_logs, load_route_logs
+
+# =========================
+# Streaming congestion anomaly detection
+# =========================
+# Runs after each logged tick and compares every corridor's new delay percent
+# with that corridor's own time-of-day baseline (weekday / weekend x 15 min
+# bins). The state per corridor has a fixed size:
+#
+#   median  streaming median per bin (sign updates scaled by the spread)
+#   scale   EWMA of the absolute deviation per bin (robust spread)
+#   count   observations per bin (no alarms until MIN_COUNT)
+#   cusum   one-sided CUSUM of the robust z-scores (slow build-ups)
+#
+# A "spike" is a robust z above Z_THRESHOLD, a "drift" is the CUSUM crossing
+# CUSUM_H. Only rises in delay are reported. Values fed into the baseline are
+# clipped to +-3 sigma so an incident does not become the new normal.
+# Everything is vectorised over corridors, so a tick of 10k corridors is one
+# numpy pass (and one hash lookup of the corridor ids). The state of 10k
+# corridors is ~40 MB, so the logger saves it every --anomaly-save-every
+# ticks and on exit rather than after each tick.
+#
+# Usage:
+#   python anomaly_detector.py replay --state anomaly_state.npz --events anomalies.jsonl
+#   python anomaly_detector.py bench --corridors 10000
+
+BIN_MINUTES = 15
+MIN_COUNT = 5
+MEDIAN_STEP = 0.1  # fraction of sigma the median moves per observation
+SCALE_ALPHA = 0.1
+SCALE_FLOOR = 2.0  # percentage points; keeps z finite on very steady corridors
+Z_THRESHOLD = 4.0
+CUSUM_K = 0.5
+CUSUM_H = 8.0
+MAD_TO_SIGMA = 1.2533  # mean absolute deviation -> std for normal data
+SAVE_EVERY_TICKS = 12  # one hour at a 5 minute cadence
+
+MINUTE_NS = 60_000_000_000
+DAY_NS = 24 * 60 * MINUTE_NS
+
+
+class AnomalyDetector:
+    """Per-corridor time-of-day baselines with robust z-score and CUSUM alarms."""
+
+    def __init__(self, bin_minutes=BIN_MINUTES):
+        self.bin_minutes = bin_minutes
+        self.n_bins = 2 * (24 * 60 // bin_minutes)  # weekday bins, then weekend bins
+        self.corridors = []
+        self.index = pd.Index([], dtype=object)  # corridor -> row
+        self.median = np.empty((0, self.n_bins))
+        self.scale = np.empty((0, self.n_bins))
+        self.count = np.empty((0, self.n_bins), dtype=np.int32)
+        self.cusum = np.empty(0)
+
+    def codes(self, corridors):
+        """Row of each corridor, adding new ones. Keep the result to skip the lookup next tick."""
+        corridors = pd.Index(np.asarray(corridors, dtype=object))
+        codes = self.index.get_indexer(corridors)
+        if (codes < 0).any():
+            new = list(dict.fromkeys(corridors[codes < 0]))
+            self.corridors.extend(new)
+            self.index = pd.Index(self.corridors, dtype=object)
+            n = len(new)
+            self.median = np.concatenate([self.median, np.zeros((n, self.n_bins))])
+            self.scale = np.concatenate([self.scale, np.zeros((n, self.n_bins))])
+            self.count = np.concatenate([self.count, np.zeros((n, self.n_bins), dtype=np.int32)])
+            self.cusum = np.r_[self.cusum, np.zeros(n)]
+            codes = self.index.get_indexer(corridors)
+        return codes.astype(np.int64)
+
+    def bins(self, timestamps):
+        ts = np.asarray(timestamps, dtype="datetime64[ns]").view(np.int64)
+        tod = (ts % DAY_NS) // (self.bin_minutes * MINUTE_NS)
+        weekend = (ts // DAY_NS + 3) % 7 >= 5  # 1970-01-01 was a Thursday
+        return tod + weekend * (self.n_bins // 2)
+
+    def observe_codes(self, codes, timestamps, percent):
+        """
+        Score and learn one reading per corridor row (codes unique within a call).
+        Returns a dict of arrays for the readings that raised an alarm.
+        """
+        percent = np.asarray(percent, dtype=float)
+        valid = ~np.isnan(percent)
+        codes, percent = codes[valid], percent[valid]
+        b = self.bins(timestamps)[valid] if np.ndim(timestamps) else np.full(len(codes), self.bins([timestamps])[0])
+
+        median = self.median[codes, b]
+        count = self.count[codes, b]
+        sigma = np.maximum(MAD_TO_SIGMA * self.scale[codes, b], SCALE_FLOOR)
+        ready = count >= MIN_COUNT
+        z = np.where(ready, (percent - median) / sigma, 0.0)
+
+        cusum = np.maximum(0.0, self.cusum[codes] + z - CUSUM_K)
+        spike = ready & (z > Z_THRESHOLD)
+        drift = ready & (cusum > CUSUM_H)
+
+        # Learn from the reading, clipped so incidents do not move the baseline much
+        first = count == 0
+        x = np.where(first, percent, np.clip(percent, median - 3 * sigma, median + 3 * sigma))
+        self.median[codes, b] = np.where(first, x, median + MEDIAN_STEP * sigma * np.sign(x - median))
+        self.scale[codes, b] = np.where(
+            first, SCALE_FLOOR, (1 - SCALE_ALPHA) * self.scale[codes, b] + SCALE_ALPHA * np.abs(x - median)
+        )
+        self.count[codes, b] = count + 1
+        self.cusum[codes] = np.where(drift, 0.0, cusum)
+
+        alarm = spike | drift
+        return {
+            "row": np.flatnonzero(valid)[alarm],
+            "code": codes[alarm],
+            "kind": np.where(spike[alarm], "spike", "drift"),
+            "difference_percent": percent[alarm],
+            "baseline_percent": median[alarm],
+            "z": z[alarm],
+            "cusum": cusum[alarm],
+        }
+
+    def observe(self, corridors, timestamps, percent):
+        """Score and learn readings given as sequences; returns anomaly events as dicts."""
+        timestamps = np.asarray(timestamps)
+        if timestamps.dtype.kind != "M":
+            timestamps = pd.to_datetime(pd.Series(timestamps)).to_numpy()
+        timestamps = timestamps.astype("datetime64[ns]", copy=False)
+        alarms = self.observe_codes(self.codes(corridors), timestamps, percent)
+        return self.events(alarms, timestamps)
+
+    def events(self, alarms, timestamps):
+        events = []
+        classes = classify_delay(alarms["difference_percent"])
+        baseline = classify_delay(alarms["baseline_percent"])
+        for i in range(len(alarms["code"])):
+            events.append(
+                {
+                    "timestamp": str(pd.Timestamp(timestamps[alarms["row"][i]])),
+                    "corridor": self.corridors[alarms["code"][i]],
+                    "kind": str(alarms["kind"][i]),
+                    "difference_percent": round(float(alarms["difference_percent"][i]), 2),
+                    "baseline_percent": round(float(alarms["baseline_percent"][i]), 2),
+                    "z": round(float(alarms["z"][i]), 2),
+                    "cusum": round(float(alarms["cusum"][i]), 2),
+                    "congestion_status": CONGESTION_CLASSES[classes[i]],
+                    "baseline_status": CONGESTION_CLASSES[baseline[i]],
+                }
+            )
+        return events
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                corridors=np.array(self.corridors, dtype=str),
+                bin_minutes=self.bin_minutes,
+                median=self.median,
+                scale=self.scale,
+                count=self.count,
+                cusum=self.cusum,
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            detector = cls(int(data["bin_minutes"]))
+            detector.corridors = [str(c) for c in data["corridors"]]
+            detector.index = pd.Index(detector.corridors, dtype=object)
+            for name in ("median", "scale", "count", "cusum"):
+                setattr(detector, name, data[name])
+        return detector
+
+
+def emit(events, path=None):
+    """Append events as JSON lines to path, or print them (stdout hook)."""
+    if not events:
+        return
+    lines = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events)
+    if path:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+    else:
+        sys.stdout.write(lines)
+
+
+def replay(df, detector=None, interval_minutes=5):
+    """Feed logged readings tick by tick (one reading per corridor per call); returns all events."""
+    detector = detector or AnomalyDetector()
+    if "is_predicted" in df:
+        # Skipped ticks carry the predictor's value, not an observation
+        df = df[~df["is_predicted"]]
+    df = df.dropna(subset=["corridor", "timestamp"]).sort_values("timestamp", kind="stable")
+    codes = detector.codes(df["corridor"])
+    ts = df["timestamp"].to_numpy("datetime64[ns]")
+    percent = df["difference_percent"].to_numpy(float)
+    tick = ts.view(np.int64) // (interval_minutes * MINUTE_NS)
+    # Two readings of a corridor in one tick go to separate calls
+    order = np.lexsort((ts, codes, tick))
+    tick, codes, ts, percent = tick[order], codes[order], ts[order], percent[order]
+    repeat = pd.Series(codes).groupby([tick, codes]).cumcount().to_numpy()
+    batch = tick * (repeat.max() + 1 if len(repeat) else 1) + repeat
+    order = np.argsort(batch, kind="stable")
+    batch, codes, ts, percent = batch[order], codes[order], ts[order], percent[order]
+    bounds = np.flatnonzero(np.r_[True, np.diff(batch) != 0, True])
+    events = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        alarms = detector.observe_codes(codes[lo:hi], ts[lo:hi], percent[lo:hi])
+        if len(alarms["code"]):
+            alarms["row"] = alarms["row"] + lo
+            events.extend(detector.events(alarms, ts))
+    return events, detector
+
+
+def benchmark(n_corridors=10000, n_ticks=2000, seed=0, save_every=SAVE_EVERY_TICKS):
+    """
+    Time one tick of n_corridors the way the logger runs it, after a warm-up
+    history: observe() with corridor ids and timestamps, and save() every
+    save_every ticks. observe_codes_p50_ms is the numpy pass alone.
+    """
+    import tempfile
+
+    rng = np.random.default_rng(seed)
+    detector = AnomalyDetector()
+    corridors = pd.Series([f"25.{i:06d},121.5000>25.0000,121.{i:06d}" for i in range(n_corridors)])
+    codes = detector.codes(corridors)
+    start = pd.Timestamp("2025-10-01 00:00")
+    observe, observe_codes, save = [], [], []
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "anomaly_state.npz")
+        for t in range(n_ticks):
+            ts = pd.Series(start + pd.Timedelta(minutes=5 * t), index=corridors.index)
+            percent = rng.gamma(2.0, 10.0, n_corridors)
+            t0 = time.perf_counter()
+            detector.observe(corridors, ts, percent)
+            observe.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            detector.observe_codes(codes, ts.to_numpy(), percent)
+            observe_codes.append(time.perf_counter() - t0)
+            if (t + 1) % save_every == 0:
+                t0 = time.perf_counter()
+                detector.save(path)
+                save.append(time.perf_counter() - t0)
+    observe = np.array(observe[n_ticks // 10 :]) * 1000
+    save_ms = float(np.median(save)) * 1000 if save else 0.0
+    return {
+        "corridors": n_corridors,
+        "ticks": n_ticks,
+        "p50_ms": round(float(np.percentile(observe, 50)), 3),
+        "p99_ms": round(float(np.percentile(observe, 99)), 3),
+        "observe_codes_p50_ms": round(float(np.percentile(np.array(observe_codes[n_ticks // 10 :]) * 1000, 50)), 3),
+        "save_ms": round(save_ms, 3),
+        "save_every": save_every,
+        "per_tick_ms": round(float(np.percentile(observe, 50)) + save_ms / save_every, 3),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streaming anomaly detection on corridor delay percent.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("replay", help="Run the detector over logged history")
+    p.add_argument("logs", nargs="*", help="Route log files (default: Data/route_log_*.xlsx)")
+    p.add_argument("--state", help="Load / save detector state here")
+    p.add_argument("--events", help="Append events to this JSONL file (default: stdout)")
+    p.add_argument("--interval-minutes", type=int, default=5, help="Scheduler interval")
+
+    p = sub.add_parser("bench", help="Per-tick latency for many corridors")
+    p.add_argument("--corridors", type=int, default=10000)
+    p.add_argument("--ticks", type=int, default=2000)
+    p.add_argument("--save-every", type=int, default=SAVE_EVERY_TICKS, help="Ticks between state saves")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "bench":
+        print(benchmark(args.corridors, args.ticks, save_every=args.save_every))
+        return
+    detector = AnomalyDetector.load(args.state) if args.state and os.path.exists(args.state) else None
+    events, detector = replay(load_route_logs(args.logs or find_logs()), detector, args.interval_minutes)
+    emit(events, args.events)
+    if args.state:
+        detector.save(args.state)
+    print(f"{len(events)} anomalies in {len(detector.corridors)} corridors", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
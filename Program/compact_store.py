@@ -0,0 +1,196 @@
+import argparse
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import observation_store as store_lib
+from route_logs import CONGESTION_CLASSES
+
+# =========================
+# Tiered retention / downsampling for the observation store
+# =========================
+# Raw ticks are kept for --raw-days. Older raw partitions are rolled up into
+# three tiers in one pass, so every tier's percentiles are exact, and then
+# dropped:
+#
+#   15min   kept --15min-days    daily partitions
+#   hourly  kept --hourly-days   monthly partitions
+#   daily   kept forever         yearly partitions
+#
+# Each rollup row is one (corridor, bin): count, mean / min / max / p50 / p90 /
+# p95 of the durations and the delay percent, and a congestion class histogram.
+#
+# Partitions with many small parts (the logger writes one per tick) are merged
+# into one part. Nothing is rewritten in place: merged parts are renamed in
+# and hide the parts they replace, dropped partitions are renamed aside, and
+# the hidden leftovers are deleted on the next pass so a scan that already
+# listed them can finish. The logger only ever adds new parts, so it is never
+# blocked. Query a tier with route_query.py --tier hourly.
+#
+# Usage:
+#   python compact_store.py
+#   python compact_store.py --loop --every-minutes 60
+
+ROLLUP_MINUTES = {"15min": 15, "hourly": 60, "daily": 24 * 60}
+RETENTION_DAYS = {store_lib.RAW_TIER: 14, "15min": 90, "hourly": 730, "daily": None}
+VALUE_COLUMNS = ["duration_with_traffic", "duration_no_traffic", "difference_percent"]
+PERCENTILES = [50, 90, 95]
+
+
+def rollup(corridors, data, bin_minutes):
+    """Summarise merged raw columns into (corridor, bin) rows; returns (corridors, columns)."""
+    if "is_predicted" in data:
+        # Rollups summarise observations only; predicted ticks are dropped with the raw day
+        observed = ~data["is_predicted"]
+        data = {name: values[observed] for name, values in data.items()}
+    bin_ns = int(bin_minutes * 60e9)
+    frame = pd.DataFrame(
+        {
+            "corridor": data["corridor"],
+            "timestamp": data["timestamp"] // bin_ns * bin_ns,
+            **{col: data[col] for col in VALUE_COLUMNS},
+        }
+    )
+    grouped = frame.groupby(["corridor", "timestamp"], sort=True)
+    keys = grouped.size().index
+
+    columns = {
+        "corridor": keys.get_level_values("corridor").to_numpy(np.int32),
+        "timestamp": keys.get_level_values("timestamp").to_numpy(np.int64),
+        "count": grouped.size().to_numpy(np.int32),
+    }
+    for col in VALUE_COLUMNS:
+        values = grouped[col]
+        columns[f"{col}_mean"] = values.mean().to_numpy()
+        columns[f"{col}_min"] = values.min().to_numpy()
+        columns[f"{col}_max"] = values.max().to_numpy()
+        for p in PERCENTILES:
+            columns[f"{col}_p{p}"] = values.quantile(p / 100).to_numpy()
+
+    # Class histogram; unknown classes (-1) are only in count
+    group = grouped.ngroup().to_numpy()
+    cls = data["congestion_class"].astype(np.int64)
+    known = cls >= 0
+    n_classes = len(CONGESTION_CLASSES)
+    hist = np.bincount(group[known] * n_classes + cls[known], minlength=len(keys) * n_classes)
+    hist = hist.reshape(len(keys), n_classes)
+    for i, name in enumerate(CONGESTION_CLASSES):
+        columns[f"n_{name.lower()}"] = hist[:, i].astype(np.int32)
+    return corridors, columns
+
+
+def retire(directory):
+    """Hide a partition from readers with one rename; purge() deletes it later."""
+    root, name = os.path.split(directory)
+    os.rename(directory, os.path.join(root, f"{store_lib.RETIRED_PREFIX}{time.time_ns()}-{name}"))
+
+
+def purge(store, tiers):
+    """Delete what earlier passes hid: retired partitions and replaced parts."""
+    removed = 0
+    for tier in tiers:
+        root = os.path.join(store, tier)
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            if name.startswith(store_lib.RETIRED_PREFIX):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+                removed += 1
+        for _, directory in store_lib.date_partitions(store, tier):
+            for path in store_lib.replaced_parts(directory):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+    return removed
+
+
+def merge_parts(directory):
+    """Merge the visible parts of a partition into one; returns the number merged."""
+    merged = store_lib.read_partition(directory)
+    if merged is None or len(merged[2]) < 2:
+        return 0
+    corridors, columns, parts = merged
+    store_lib.write_part(directory, corridors, columns, replaces=[os.path.basename(p) for p in parts])
+    return len(parts)
+
+
+def compact(store=store_lib.STORE_DIR, now=None, retention=RETENTION_DAYS):
+    """One compaction pass; returns counts of what was done."""
+    today = pd.Timestamp(now or datetime.now()).normalize()
+    tiers = [store_lib.RAW_TIER] + list(ROLLUP_MINUTES)
+    report = {"purged": purge(store, tiers), "rolled_up": 0, "dropped": 0, "merged_parts": 0}
+
+    # Raw days past the raw window -> all rollup tiers, then drop the raw day.
+    # Rollup parts are named after their source day, so a pass interrupted
+    # before the drop does not count that day twice when it is repeated.
+    raw_cutoff = today - pd.Timedelta(days=max(retention[store_lib.RAW_TIER], 1))
+    for date, directory in store_lib.date_partitions(store, store_lib.RAW_TIER, end=raw_cutoff):
+        if store_lib.partition_period(date).end_time >= raw_cutoff:
+            continue
+        merged = store_lib.read_partition(directory)
+        if merged is not None:
+            corridors, data, _ = merged
+            for tier, minutes in ROLLUP_MINUTES.items():
+                names, columns = rollup(corridors, data, minutes)
+                target = os.path.join(store, tier, store_lib.partition_name(date, tier))
+                store_lib.write_part(target, names, columns, name=f"part-from-{date}")
+        retire(directory)
+        report["rolled_up"] += 1
+
+    for tier in ROLLUP_MINUTES:
+        days = retention.get(tier)
+        if days is None:
+            continue
+        cutoff = today - pd.Timedelta(days=days)
+        for date, directory in store_lib.date_partitions(store, tier, end=cutoff):
+            if store_lib.partition_period(date, tier).end_time < cutoff:
+                retire(directory)
+                report["dropped"] += 1
+
+    for tier in tiers:
+        for _, directory in store_lib.date_partitions(store, tier):
+            report["merged_parts"] += merge_parts(directory)
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Roll old observations into 15min/hourly/daily tiers.")
+    parser.add_argument("--store", default=store_lib.STORE_DIR, help="Observation store directory")
+    parser.add_argument("--raw-days", type=int, default=RETENTION_DAYS[store_lib.RAW_TIER], help="Days of raw ticks to keep")
+    parser.add_argument("--15min-days", dest="quarter_days", type=int, default=RETENTION_DAYS["15min"], help="Days of 15min rollups to keep")
+    parser.add_argument("--hourly-days", type=int, default=RETENTION_DAYS["hourly"], help="Days of hourly rollups to keep")
+    parser.add_argument("--loop", action="store_true", help="Keep running in the background")
+    parser.add_argument("--every-minutes", type=float, default=60, help="Interval between passes with --loop")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    retention = {
+        store_lib.RAW_TIER: args.raw_days,
+        "15min": args.quarter_days,
+        "hourly": args.hourly_days,
+        "daily": None,
+    }
+    if args.loop and hasattr(os, "nice"):
+        # Background job: leave the CPU to the logger and queries
+        os.nice(10)
+    while True:
+        t0 = time.perf_counter()
+        report = compact(args.store, retention=retention)
+        print(
+            f"{datetime.now():%Y-%m-%d %H:%M:%S} compaction: "
+            + ", ".join(f"{k} {v}" for k, v in report.items())
+            + f" ({time.perf_counter() - t0:.2f}s)"
+        )
+        if not args.loop:
+            break
+        time.sleep(args.every_minutes * 60)
+
+
+if __name__ == "__main__":
+    main()
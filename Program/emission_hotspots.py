@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from route_geometry import decode_polylines
+from route_logs import load_route_logs, find_logs
+
+# =========================
+# Congestion emission hotspot raster
+# =========================
+# Following "Urban emissions hotspots: Quantifying vehicle congestion and air
+# pollution using mobile phone GPS data", every logged observation is turned
+# into excess CO2 (congested vs free-flow driving over the same route) and
+# spread along its geometry onto a lat/lng grid, one layer per hour of day.
+#
+# Geometry is the route polyline when the probe logged one, otherwise the
+# straight OD segment. When speed intervals were logged the excess is put on
+# the SLOW / TRAFFIC_JAM stretches instead of the whole route.
+#
+# Usage:
+#   python emission_hotspots.py --out hotspots
+#   python emission_hotspots.py --cell-meters 100 --bbox 24.95 121.40 25.22 121.70
+
+# Taipei basin
+DEFAULT_BBOX = (24.95, 121.40, 25.22, 121.70)  # (lat_min, lng_min, lat_max, lng_max)
+DEFAULT_CELL_METERS = 250
+EARTH_RADIUS_M = 6371000.0
+
+# Speed-dependent CO2 curve for a passenger car, g/km with v in km/h:
+#   EF(v) = A / v + B + C * v^2
+EF_A = 3000.0
+EF_B = 100.0
+EF_C = 0.005
+MIN_SPEED_KMH = 3.0
+
+# Relative share of the delay carried by each speed reading class
+SPEED_CLASS_WEIGHT = {"NORMAL": 0.0, "SLOW": 1.0, "TRAFFIC_JAM": 3.0}
+
+# Polyline detour when only the straight OD segment is known
+STRAIGHT_LINE_DETOUR = 1.3
+
+
+def co2_grams_per_km(speed_kmh):
+    v = np.maximum(np.asarray(speed_kmh, dtype=float), MIN_SPEED_KMH)
+    return EF_A / v + EF_B + EF_C * v**2
+
+
+def haversine_m(lat0, lng0, lat1, lng1):
+    lat0, lng0, lat1, lng1 = (np.radians(np.asarray(a, dtype=float)) for a in (lat0, lng0, lat1, lng1))
+    a = np.sin((lat1 - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat1) * np.sin((lng1 - lng0) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def parse_speed_intervals(text, n_points):
+    """Per-segment class weights from 'start-end:SPEED;...' (None if absent)."""
+    if not isinstance(text, str) or not text or n_points < 2:
+        return None
+    weights = np.zeros(n_points - 1)
+    for item in text.split(";"):
+        span, _, speed = item.partition(":")
+        start, _, end = span.partition("-")
+        weights[int(start or 0) : int(end or 0)] = SPEED_CLASS_WEIGHT.get(speed, 0.0)
+    return weights if weights.any() else None
+
+
+def excess_emissions(df):
+    """Excess CO2 in grams for each observation (NaN where durations are missing)."""
+    straight_km = haversine_m(df["origin_lat"], df["origin_lng"], df["dest_lat"], df["dest_lng"]) / 1000
+    length_km = df["distance_km"].fillna(pd.Series(straight_km * STRAIGHT_LINE_DETOUR, index=df.index))
+    hours_with = df["duration_with_traffic"] / 60
+    hours_no = df["duration_no_traffic"] / 60
+    ef_congested = co2_grams_per_km(length_km / hours_with)
+    ef_free = co2_grams_per_km(length_km / hours_no)
+    return np.clip(length_km * (ef_congested - ef_free), 0, None)
+
+
+def geometry_template(points, speed_intervals):
+    """Segments of one geometry as rows (lat0, lng0, lat1, lng1, share of excess)."""
+    if len(points) < 2:
+        return np.empty((0, 5))
+    seg_len = haversine_m(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    weights = parse_speed_intervals(speed_intervals, len(points))
+    share = seg_len * weights if weights is not None else seg_len
+    if share.sum() <= 0:
+        share = seg_len if seg_len.sum() > 0 else np.ones_like(seg_len)
+    return np.column_stack([points[:-1], points[1:], share / share.sum()])
+
+
+def build_segments(df):
+    """
+    Aggregate observations per (geometry, hour) and explode them into line segments.
+    Each distinct geometry is decoded once; returns lat0, lng0, lat1, lng1, grams, hour.
+    """
+    df = df.assign(excess_g=excess_emissions(df), hour=df["timestamp"].dt.hour)
+    df = df[df["excess_g"] > 0]
+    poly_codes, poly_values = pd.factorize(df["polyline"], use_na_sentinel=True)
+    iv_codes, iv_values = pd.factorize(df["speed_intervals"], use_na_sentinel=True)
+    od_codes, _ = pd.factorize(df["corridor"])
+    # Without a polyline the geometry is the corridor's straight OD segment
+    key = np.where(
+        poly_codes >= 0,
+        poly_codes.astype(np.int64) * (len(iv_values) + 1) + iv_codes + 1,
+        -1 - od_codes.astype(np.int64),
+    )
+    codes, uniques = pd.factorize(key)
+    if len(uniques) == 0:
+        return tuple(np.empty(0) for _ in range(5)) + (np.empty(0, dtype=np.int64),)
+
+    first = pd.Series(np.arange(len(df))).groupby(codes).first().to_numpy()
+    od = df[["origin_lat", "origin_lng", "dest_lat", "dest_lng"]].to_numpy()
+    decoded = decode_polylines(poly_values)
+    templates = [
+        geometry_template(
+            decoded[poly_codes[i]] if poly_codes[i] >= 0 else od[i].reshape(2, 2),
+            iv_values[iv_codes[i]] if iv_codes[i] >= 0 else None,
+        )
+        for i in first
+    ]
+    counts = np.array([len(t) for t in templates], dtype=np.int64)
+    offsets = np.cumsum(counts) - counts
+    template = np.concatenate(templates)
+
+    hour = df["hour"].to_numpy()
+    group = codes.astype(np.int64) * 24 + hour
+    group_ids, inverse = np.unique(group, return_inverse=True)
+    excess = np.bincount(inverse, weights=df["excess_g"].to_numpy())
+    geom = group_ids // 24
+
+    n = counts[geom]
+    rep = np.repeat(np.arange(len(group_ids)), n)
+    idx = offsets[geom][rep] + np.arange(n.sum()) - (np.cumsum(n) - n)[rep]
+    rows = template[idx]
+    grams = excess[rep] * rows[:, 4]
+    return rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3], grams, (group_ids % 24)[rep]
+
+
+def make_grid(bbox=DEFAULT_BBOX, cell_meters=DEFAULT_CELL_METERS):
+    lat_min, lng_min, lat_max, lng_max = bbox
+    mid_lat = np.radians((lat_min + lat_max) / 2)
+    dlat = np.degrees(cell_meters / EARTH_RADIUS_M)
+    dlng = dlat / np.cos(mid_lat)
+    ny = int(np.ceil((lat_max - lat_min) / dlat))
+    nx = int(np.ceil((lng_max - lng_min) / dlng))
+    return {
+        "lat_min": lat_min,
+        "lng_min": lng_min,
+        "dlat": dlat,
+        "dlng": dlng,
+        "ny": ny,
+        "nx": nx,
+        "cell_meters": cell_meters,
+    }
+
+
+def rasterise(lat0, lng0, lat1, lng1, grams, hour, grid):
+    """
+    Spread each segment's grams evenly along its length into a (24, ny, nx) grid.
+    Segments are sampled at half-cell spacing in one vectorised pass.
+    """
+    ny, nx = grid["ny"], grid["nx"]
+    raster = np.zeros(24 * ny * nx)
+    if len(grams) == 0:
+        return raster.reshape(24, ny, nx)
+
+    span_cells = np.maximum(np.abs(lat1 - lat0) / grid["dlat"], np.abs(lng1 - lng0) / grid["dlng"])
+    n = np.ceil(span_cells * 2).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(n)), n)
+    starts = np.cumsum(n) - n
+    t = (np.arange(n.sum()) - starts[seg] + 0.5) / n[seg]
+
+    lat = lat0[seg] + (lat1 - lat0)[seg] * t
+    lng = lng0[seg] + (lng1 - lng0)[seg] * t
+    iy = np.floor((lat - grid["lat_min"]) / grid["dlat"]).astype(np.int64)
+    ix = np.floor((lng - grid["lng_min"]) / grid["dlng"]).astype(np.int64)
+    inside = (iy >= 0) & (iy < ny) & (ix >= 0) & (ix < nx)
+
+    flat = (hour[seg] * ny + iy) * nx + ix
+    weight = (grams / n)[seg]
+    # bincount is the fast equivalent of np.add.at for a flat index
+    raster += np.bincount(flat[inside], weights=weight[inside], minlength=raster.size)
+    return raster.reshape(24, ny, nx)
+
+
+def write_layers(raster, grid, out_dir):
+    """Write one .npy and one CSV (non-zero cells) per hour, plus grid metadata."""
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "grid.json"), "w") as f:
+        json.dump(grid, f, indent=2)
+    for h in range(24):
+        layer = raster[h]
+        np.save(os.path.join(out_dir, f"hotspots_h{h:02d}.npy"), layer)
+        iy, ix = np.nonzero(layer)
+        pd.DataFrame(
+            {
+                "lat": grid["lat_min"] + (iy + 0.5) * grid["dlat"],
+                "lng": grid["lng_min"] + (ix + 0.5) * grid["dlng"],
+                "excess_co2_g": layer[iy, ix],
+            }
+        ).to_csv(os.path.join(out_dir, f"hotspots_h{h:02d}.csv"), index=False)
+
+
+def build_hotspots(df, bbox=DEFAULT_BBOX, cell_meters=DEFAULT_CELL_METERS):
+    grid = make_grid(bbox, cell_meters)
+    raster = rasterise(*build_segments(df), grid)
+    return raster, grid
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Rasterise congestion excess CO2 from route logs into hourly layers."
+    )
+    parser.add_argument("logs", nargs="*", help="Route log files (default: Data/route_log_*.xlsx)")
+    parser.add_argument("--out", default="hotspots", help="Output directory")
+    parser.add_argument(
+        "--cell-meters", type=float, default=DEFAULT_CELL_METERS, help="Grid cell size in meters"
+    )
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        default=DEFAULT_BBOX,
+        metavar=("LAT_MIN", "LNG_MIN", "LAT_MAX", "LNG_MAX"),
+        help="Grid extent",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = load_route_logs(args.logs or find_logs())
+    raster, grid = build_hotspots(df, tuple(args.bbox), args.cell_meters)
+    write_layers(raster, grid, args.out)
+    print(
+        f"{len(df)} observations -> {grid['ny']}x{grid['nx']} grid, "
+        f"{raster.sum() / 1000:.1f} kg excess CO2 written to {args.out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
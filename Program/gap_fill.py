@@ -0,0 +1,298 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from route_logs import classify_delay, find_logs, load_route_logs
+
+# =========================
+# Gap filling / backfill for route logs
+# =========================
+# Failed calls ("API error", "No routes found") log rows of None, and slots the
+# scheduler missed are not logged at all. This stage puts every corridor back
+# on its tick grid and imputes the missing durations:
+#
+#   observed      value came from the API
+#   interpolated  short gap, linear between the neighbouring observed ticks
+#   profile       longer gap, corridor's time-of-day (weekday/weekend) mean
+#   unfilled      no neighbours and no profile for that time of day yet
+#   predicted     the logger skipped the call and logged the predictor's value
+#
+# The tick grid follows each log file's own cadence (median spacing per
+# corridor and file) unless --interval-minutes is given. Gaps longer than
+# --max-gap-minutes (or --max-gap-ticks, when given) are treated as "logger
+# not running" and are not materialised, and so are the gaps of logs whose
+# inferred cadence is under MIN_INTERVAL_SECONDS (manual test runs). Everything is vectorised, so months of logs backfill
+# in one pass. With --state-dir the profile, the last observed ticks of each
+# corridor and the last slot already written out are kept between runs, so
+# new logs can be filled incrementally without emitting a slot twice.
+#
+# Usage:
+#   python gap_fill.py --out route_log_filled.csv
+#   python gap_fill.py new_log.xlsx --state-dir gapfill_state --out new_filled.csv
+
+INTERVAL_MINUTES = 5
+MAX_GAP_MINUTES = 60
+MIN_INTERVAL_SECONDS = 60  # inferred cadences below this are test runs, their gaps are not filled
+INTERP_MAX_TICKS = 3
+PROFILE_BIN_MINUTES = 15
+
+VALUE_COLUMNS = ["duration_with_traffic", "duration_no_traffic"]
+QUALITY_LEVELS = ["observed", "interpolated", "profile", "unfilled", "predicted"]
+PROFILE_FILE = "profile.csv"
+TAIL_FILE = "tail.csv"
+EMITTED_FILE = "emitted.csv"
+
+
+def _profile_keys(df, bin_minutes=PROFILE_BIN_MINUTES):
+    ts = df["timestamp"]
+    return pd.DataFrame(
+        {
+            "corridor": df["corridor"].to_numpy(),
+            "weekend": (ts.dt.weekday >= 5).to_numpy(),
+            "tod_bin": ((ts.dt.hour * 60 + ts.dt.minute) // bin_minutes).to_numpy(),
+        },
+        index=df.index,
+    )
+
+
+def update_profile(profile, df, bin_minutes=PROFILE_BIN_MINUTES):
+    """Add observed rows of df to the running (sum, count) time-of-day profile."""
+    observed = df[df[VALUE_COLUMNS].notna().all(axis=1)]
+    if "is_predicted" in observed:
+        observed = observed[~observed["is_predicted"].fillna(False).astype(bool)]
+    keys = _profile_keys(observed, bin_minutes)
+    sums = pd.concat([keys, observed[VALUE_COLUMNS]], axis=1).assign(count=1)
+    sums = sums.groupby(["corridor", "weekend", "tod_bin"]).sum()
+    if profile is not None and len(profile):
+        sums = sums.add(profile.set_index(["corridor", "weekend", "tod_bin"]), fill_value=0)
+    return sums.reset_index()
+
+
+def _profile_values(profile, keys):
+    """Profile means for each row of keys (NaN where the profile has no data)."""
+    if profile is None or not len(profile):
+        return pd.DataFrame(np.nan, index=keys.index, columns=VALUE_COLUMNS)
+    mean = profile.set_index(["corridor", "weekend", "tod_bin"])
+    mean = mean[VALUE_COLUMNS].div(mean["count"], axis=0)
+    exact = keys.join(mean, on=["corridor", "weekend", "tod_bin"])[VALUE_COLUMNS]
+    # Fall back to the same time of day on any day type
+    any_day = mean.groupby(level=["corridor", "tod_bin"]).mean()
+    loose = keys.join(any_day, on=["corridor", "tod_bin"])[VALUE_COLUMNS]
+    return exact.fillna(loose)
+
+
+def infer_intervals(df, default_minutes=INTERVAL_MINUTES):
+    """
+    Scheduler interval in seconds for every row: the median spacing of its
+    corridor within its log file (runs use different --interval-minutes),
+    else of the corridor, else default_minutes.
+    """
+    ts = df["timestamp"].to_numpy("datetime64[ns]").astype(np.int64)
+    source = df["source_file"].fillna("") if "source_file" in df else pd.Series("", index=df.index)
+    keys = [df["corridor"], source]
+    step = pd.Series(ts, index=df.index).groupby(keys, sort=False).diff() / 1e9
+    step = step.where(step > 0)
+    per_file = step.groupby(keys, sort=False).transform("median")
+    per_corridor = step.groupby(df["corridor"], sort=False).transform("median")
+    seconds = per_file.fillna(per_corridor).fillna(default_minutes * 60)
+    return np.maximum(seconds.round().to_numpy(), 1).astype(np.int64)
+
+
+def add_missed_slots(df, interval_minutes=None, max_gap_minutes=MAX_GAP_MINUTES, max_gap_ticks=None):
+    """
+    Insert empty rows for scheduler slots that produced no log row at all.
+    interval_minutes=None infers the cadence per corridor and log file and
+    leaves the gaps of sub-minute (test) logs empty. max_gap_ticks optionally
+    caps a fillable gap in ticks on top of max_gap_minutes. Adds 'slot', a
+    per-corridor tick counter used for interpolation.
+    """
+    df = df.sort_values(["corridor", "timestamp"], kind="stable").reset_index(drop=True)
+    if not len(df):
+        return df.assign(slot=np.empty(0, dtype=np.int64))
+    if interval_minutes is None:
+        interval = infer_intervals(df)
+    else:
+        interval = np.full(len(df), int(round(interval_minutes * 60)), dtype=np.int64)
+    ts = df["timestamp"].to_numpy("datetime64[ns]").astype(np.int64)
+
+    # Ticks between consecutive rows of a corridor, in the earlier row's cadence
+    same = df["corridor"].to_numpy()[1:] == df["corridor"].to_numpy()[:-1]
+    step = np.rint(np.diff(ts) / (interval[:-1] * 1e9)).astype(np.int64)
+    step = np.where(same, np.maximum(step, 1), 0)
+    start = np.r_[True, ~same]
+    counter = np.r_[0, np.cumsum(step)]
+    slot = counter - np.maximum.accumulate(np.where(start, counter, 0))
+
+    max_slots = max_gap_minutes * 60 // interval[:-1]
+    if max_gap_ticks is not None:
+        max_slots = np.minimum(max_slots, max_gap_ticks)
+    gap = same & (step > 1) & (step <= max_slots)
+    if interval_minutes is None:
+        gap &= interval[:-1] >= MIN_INTERVAL_SECONDS
+    n_missing = np.where(gap, step - 1, 0)
+    if n_missing.sum() == 0:
+        return df.assign(slot=slot)
+
+    prev = np.repeat(np.arange(len(step)), n_missing)
+    offset = np.arange(n_missing.sum()) - np.repeat(np.cumsum(n_missing) - n_missing, n_missing) + 1
+    missed = df.iloc[prev][["corridor", "origin_lat", "origin_lng", "dest_lat", "dest_lng"]].reset_index(drop=True)
+    missed["timestamp"] = pd.to_datetime(ts[prev] + offset * interval[prev] * 1_000_000_000)
+    missed["slot"] = slot[prev] + offset
+
+    df = pd.concat([df.assign(slot=slot), missed], ignore_index=True)
+    return df.sort_values(["corridor", "slot", "timestamp"], kind="stable").reset_index(drop=True)
+
+
+def fill_gaps(df, profile=None, interval_minutes=None, max_gap_minutes=MAX_GAP_MINUTES, max_gap_ticks=None,
+              interp_max_ticks=INTERP_MAX_TICKS, bin_minutes=PROFILE_BIN_MINUTES):
+    """
+    Return df on a complete tick grid with imputed values and a 'quality' column.
+    profile is a running profile from update_profile(); by default it is built
+    from the observed rows of df.
+    """
+    df = add_missed_slots(df, interval_minutes, max_gap_minutes, max_gap_ticks)
+    valid = df[VALUE_COLUMNS].notna().all(axis=1).to_numpy()
+    quality = np.where(valid, 0, 3).astype(np.int8)
+    if "is_predicted" in df:
+        # Predicted ticks are neighbours for interpolation but are not observations
+        quality[valid & df["is_predicted"].fillna(False).astype(bool).to_numpy()] = 4
+
+    # Neighbouring ticks: previous / next observed tick of the same corridor
+    group = df["corridor"]
+    slot = df["slot"].astype(float)
+    obs_slot = slot.where(valid)
+    prev_slot = obs_slot.groupby(group).ffill()
+    next_slot = obs_slot.groupby(group).bfill()
+    span = next_slot - prev_slot
+    interp = ~valid & (span <= interp_max_ticks + 1).to_numpy() & (span > 0).to_numpy()
+    w = ((slot - prev_slot) / span).to_numpy()
+    for col in VALUE_COLUMNS:
+        obs = df[col].where(valid)
+        before = obs.groupby(group).ffill().to_numpy()
+        after = obs.groupby(group).bfill().to_numpy()
+        df.loc[interp, col] = (before + (after - before) * w)[interp]
+    quality[interp] = 1
+
+    # Time-of-day profile for everything the neighbours could not cover
+    if profile is None:
+        profile = update_profile(None, df[valid], bin_minutes)
+    rest = quality == 3
+    if rest.any():
+        values = _profile_values(profile, _profile_keys(df[rest], bin_minutes))
+        filled = values.notna().all(axis=1).to_numpy()
+        idx = np.flatnonzero(rest)[filled]
+        df.loc[idx, VALUE_COLUMNS] = values.to_numpy()[filled]
+        quality[idx] = 2
+
+    # Keep the derived columns consistent with the imputed durations
+    imputed = (quality == 1) | (quality == 2)
+    with_t = df["duration_with_traffic"]
+    no_t = df["duration_no_traffic"]
+    diff = with_t - no_t
+    df.loc[imputed, "difference_seconds"] = (diff * 60).round()[imputed]
+    df.loc[imputed, "difference_percent"] = (diff / no_t * 100).round(2)[imputed]
+    df.loc[imputed, "congestion_class"] = classify_delay(df["difference_percent"])[imputed]
+
+    df["quality"] = pd.Categorical.from_codes(quality, QUALITY_LEVELS)
+    return df
+
+
+def load_state(state_dir):
+    """(profile, tail, emitted): emitted is the last timestamp written out per corridor."""
+    profile_path = os.path.join(state_dir, PROFILE_FILE)
+    tail_path = os.path.join(state_dir, TAIL_FILE)
+    emitted_path = os.path.join(state_dir, EMITTED_FILE)
+    profile = pd.read_csv(profile_path) if os.path.exists(profile_path) else None
+    tail = pd.read_csv(tail_path, parse_dates=["timestamp"]) if os.path.exists(tail_path) else None
+    emitted = None
+    if os.path.exists(emitted_path):
+        emitted = pd.read_csv(emitted_path, parse_dates=["timestamp"]).set_index("corridor")["timestamp"]
+    return profile, tail, emitted
+
+
+def save_state(state_dir, profile, filled, emitted=None, max_gap_minutes=MAX_GAP_MINUTES):
+    """
+    Keep the profile, the observed rows in the last max_gap window of each
+    corridor (neighbours for the next batch) and the last emitted slot.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    profile.to_csv(os.path.join(state_dir, PROFILE_FILE), index=False)
+    last = filled.groupby("corridor")["timestamp"].transform("max")
+    tail = filled[filled["timestamp"] >= last - pd.Timedelta(minutes=max_gap_minutes)]
+    tail = tail[tail["quality"] == "observed"]
+    tail.drop(columns=["quality", "slot"]).to_csv(os.path.join(state_dir, TAIL_FILE), index=False)
+    # Trailing failed / missed slots are emitted but not in the tail; remember them too
+    until = filled.groupby("corridor")["timestamp"].max()
+    if emitted is not None:
+        until = pd.concat([emitted, until]).groupby(level=0).max()
+    until.rename_axis("corridor").reset_index().to_csv(os.path.join(state_dir, EMITTED_FILE), index=False)
+
+
+def _after_cutoff(df, cutoff):
+    """Rows newer than their corridor's cutoff timestamp (all rows if no cutoff)."""
+    if cutoff is None:
+        return np.ones(len(df), dtype=bool)
+    last = df["corridor"].map(cutoff)
+    return (last.isna() | (df["timestamp"] > last)).to_numpy()
+
+
+def fill_incremental(new, state_dir, **kwargs):
+    """
+    Fill a new batch of logs using the saved state, then update the state.
+    The previous tail is prepended so gaps across the batch boundary are found,
+    but only rows after the tail are returned.
+    """
+    profile, tail, emitted = load_state(state_dir)
+    cutoff = emitted
+    if cutoff is None and tail is not None and len(tail):
+        # State written before emitted.csv existed
+        cutoff = tail.groupby("corridor")["timestamp"].max()
+    new = new[_after_cutoff(new, cutoff)]
+    combined = pd.concat([tail, new], ignore_index=True) if tail is not None and len(tail) else new
+
+    # The tail's observed rows are already in the saved profile
+    profile = update_profile(profile, new, kwargs.get("bin_minutes", PROFILE_BIN_MINUTES))
+    filled = fill_gaps(combined, profile=profile, **kwargs)
+    save_state(state_dir, profile, filled, cutoff, kwargs.get("max_gap_minutes", MAX_GAP_MINUTES))
+    return filled[_after_cutoff(filled, cutoff)].reset_index(drop=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fill failed and missed ticks in route logs from neighbours and time-of-day profiles."
+    )
+    parser.add_argument("logs", nargs="*", help="Route log files (default: Data/route_log_*.xlsx)")
+    parser.add_argument("--out", default="route_log_filled.csv", help="Output CSV")
+    parser.add_argument("--state-dir", help="Keep profile/tail here and fill incrementally")
+    parser.add_argument(
+        "--interval-minutes", type=float, default=None,
+        help="Scheduler interval (default: inferred per corridor and log file)",
+    )
+    parser.add_argument(
+        "--max-gap-minutes", type=int, default=MAX_GAP_MINUTES, help="Longer gaps are not filled"
+    )
+    parser.add_argument("--max-gap-ticks", type=int, default=None, help="Also leave gaps of more ticks unfilled")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = load_route_logs(args.logs or find_logs())
+    options = {
+        "interval_minutes": args.interval_minutes,
+        "max_gap_minutes": args.max_gap_minutes,
+        "max_gap_ticks": args.max_gap_ticks,
+    }
+    if args.state_dir:
+        filled = fill_incremental(df, args.state_dir, **options)
+    else:
+        filled = fill_gaps(df, **options)
+    filled.drop(columns=["slot"]).to_csv(args.out, index=False)
+    counts = filled["quality"].value_counts().reindex(QUALITY_LEVELS, fill_value=0)
+    print(", ".join(f"{name}: {n}" for name, n in counts.items()) + f" -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import json
+import os
+import shutil
+import time
+from operator import eq, ge, gt, le, lt, ne
+
+import numpy as np
+import pandas as pd
+
+# =========================
+# Columnar observation store
+# =========================
+# Route observations partitioned by date. Every write is one part directory
+# with one .npy per column, rows sorted by (corridor, timestamp):
+#
+#   <store>/raw/date=2025-10-04/part-<ns>-<pid>/
+#       corridors.json      sorted corridor ids present in this part
+#       corridor.npy        int32 index into corridors.json (sorted)
+#       timestamp.npy       int64 ns
+#       duration_with_traffic.npy ...
+#
+# Readers prune date partitions by name, skip parts whose corridors.json has
+# none of the wanted corridors, memory-map the column files and read only the
+# row range of those corridors (like row groups), and apply the remaining
+# predicates before anything is concatenated. Parts are written to a temp
+# directory and renamed, so a reader never sees half a part.
+#
+# Rollup tiers (compact_store.py) use the same layout with longer partitions.
+# A part may carry replaces.json, listing older parts of the same partition it
+# was merged from; readers skip those, so a merge is one atomic rename.
+
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data", "observation_store")
+RAW_TIER = "raw"
+CORRIDORS_FILE = "corridors.json"
+REPLACES_FILE = "replaces.json"
+RETIRED_PREFIX = ".retired-"
+
+# Partition length of each tier (pandas period codes)
+TIER_PERIODS = {RAW_TIER: "D", "15min": "D", "hourly": "M", "daily": "Y"}
+
+# Comparison operators of scan() predicates
+OPS = {"=": eq, "==": eq, "!=": ne, "<": lt, "<=": le, ">": gt, ">=": ge}
+
+SCHEMA = {
+    "timestamp": np.int64,  # ns since epoch, local time as logged
+    "duration_with_traffic": np.float64,
+    "duration_no_traffic": np.float64,
+    "difference_seconds": np.float64,
+    "difference_percent": np.float64,
+    "distance_km": np.float64,
+    "congestion_class": np.int8,
+    "is_predicted": np.bool_,  # logged from the predictor instead of the API (older parts lack it)
+}
+
+
+def partition_period(date, tier=RAW_TIER):
+    """The pd.Period covered by the partition holding date in tier."""
+    return pd.Period(date, TIER_PERIODS.get(tier, "D"))
+
+
+def partition_name(date, tier=RAW_TIER):
+    return "date=" + partition_period(date, tier).start_time.strftime("%Y-%m-%d")
+
+
+def write_part(directory, corridors, columns, name=None, replaces=()):
+    """
+    Write one part: corridors is a sorted list of ids, columns a dict of equal-length
+    arrays including 'corridor' (int32 codes, sorted). name defaults to a unique
+    part-<ns>-<pid>; replaces lists parts this one supersedes. Returns the part
+    path, or None when a part of that name already exists.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name or f"part-{time.time_ns()}-{os.getpid()}")
+    if os.path.exists(path):
+        return None
+    tmp = path + ".tmp"
+    # A leftover from an interrupted write of the same named part
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, CORRIDORS_FILE), "w", encoding="utf-8") as f:
+        json.dump(list(corridors), f)
+    if replaces:
+        with open(os.path.join(tmp, REPLACES_FILE), "w", encoding="utf-8") as f:
+            json.dump(list(replaces), f)
+    for name, values in columns.items():
+        np.save(os.path.join(tmp, name + ".npy"), values)
+    os.rename(tmp, path)
+    return path
+
+
+def to_columns(df, schema=SCHEMA):
+    """(corridors, columns) for a DataFrame, sorted by corridor and timestamp."""
+    df = df.sort_values(["corridor", "timestamp"], kind="stable")
+    codes, corridors = pd.factorize(df["corridor"], sort=True)
+    columns = {"corridor": codes.astype(np.int32)}
+    for name, dtype in schema.items():
+        if name == "timestamp":
+            columns[name] = df["timestamp"].to_numpy("datetime64[ns]").astype(np.int64)
+        elif name in df:
+            columns[name] = df[name].to_numpy(dtype=dtype)
+        else:
+            columns[name] = _missing_column(name, len(df))
+    return list(corridors), columns
+
+
+def _missing_column(name, n):
+    """Values of a column a part does not have: NaN, or zeros for integer / bool columns."""
+    dtype = SCHEMA.get(name, np.float64)
+    return np.full(n, np.nan) if np.issubdtype(dtype, np.floating) else np.zeros(n, dtype=dtype)
+
+
+def append(df, store=STORE_DIR, tier=RAW_TIER):
+    """Append normalised observations (route_logs layout) as one new part per partition."""
+    df = df.dropna(subset=["timestamp", "corridor"])
+    if not len(df):
+        return 0
+    periods = df["timestamp"].dt.to_period(TIER_PERIODS.get(tier, "D"))
+    for period, part in df.groupby(periods, sort=False):
+        corridors, columns = to_columns(part)
+        write_part(os.path.join(store, tier, partition_name(period.start_time, tier)), corridors, columns)
+    return len(df)
+
+
+def date_partitions(store=STORE_DIR, tier=RAW_TIER, start=None, end=None):
+    """(date, directory) of every partition overlapping [start, end); date is the period start."""
+    root = os.path.join(store, tier)
+    if not os.path.isdir(root):
+        return []
+    lo = pd.Timestamp(start) if start is not None else None
+    hi = pd.Timestamp(end) if end is not None else None
+    found = []
+    for name in sorted(os.listdir(root)):
+        if not name.startswith("date="):
+            continue
+        date = name.split("=", 1)[1]
+        period = partition_period(date, tier)
+        if (lo is not None and period.end_time < lo) or (hi is not None and period.start_time >= hi):
+            continue
+        found.append((date, os.path.join(root, name)))
+    return found
+
+
+def _all_parts(directory):
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.startswith("part-") and not name.endswith(".tmp")
+    )
+
+
+def replaced_parts(directory):
+    """Parts of a partition that a merged part supersedes (hidden from readers)."""
+    replaced = set()
+    for path in _all_parts(directory):
+        marker = os.path.join(path, REPLACES_FILE)
+        if os.path.exists(marker):
+            with open(marker, encoding="utf-8") as f:
+                replaced.update(json.load(f))
+    return [os.path.join(directory, name) for name in sorted(replaced)]
+
+
+def part_dirs(directory):
+    """Visible parts of a partition."""
+    hidden = set(replaced_parts(directory))
+    return [path for path in _all_parts(directory) if path not in hidden]
+
+
+def tier_columns(store=STORE_DIR, tier=RAW_TIER):
+    """Column names stored in a tier (read from its first part), without 'corridor'."""
+    for _, directory in date_partitions(store, tier):
+        for path in part_dirs(directory):
+            names = sorted(name[:-4] for name in os.listdir(path) if name.endswith(".npy"))
+            return ["timestamp"] + [name for name in names if name not in ("corridor", "timestamp")]
+    return list(SCHEMA)
+
+
+def read_part(path, columns, corridors=None):
+    """
+    Read columns of one part, restricted to the row ranges of the wanted corridors.
+    Returns (corridor names, data dict) or None when the part has none of them.
+    """
+    with open(os.path.join(path, CORRIDORS_FILE), encoding="utf-8") as f:
+        names = json.load(f)
+    if corridors is None:
+        rows = None
+    else:
+        wanted = [i for i, name in enumerate(names) if name in corridors]
+        if not wanted:
+            return None
+        codes = np.load(os.path.join(path, "corridor.npy"), mmap_mode="r")
+        bounds = [(np.searchsorted(codes, i, "left"), np.searchsorted(codes, i, "right")) for i in wanted]
+        rows = np.concatenate([np.arange(lo, hi) for lo, hi in bounds])
+    data = {}
+    n = None
+    for name in columns:
+        file = os.path.join(path, name + ".npy")
+        if not os.path.exists(file):
+            continue
+        values = np.load(file, mmap_mode="r")
+        data[name] = np.asarray(values if rows is None else values[rows])
+        n = len(data[name])
+    for name in columns:
+        if name not in data:
+            if n is None:
+                n = len(rows) if rows is not None else len(np.load(os.path.join(path, "corridor.npy"), mmap_mode="r"))
+            data[name] = _missing_column(name, n)
+    return names, data
+
+
+def read_partition(directory):
+    """
+    All visible parts of a partition merged and sorted by (corridor, timestamp).
+    Returns (corridors, columns, part paths) or None for an empty partition.
+    """
+    parts = part_dirs(directory)
+    if not parts:
+        return None
+    # Parts written before a column was added to SCHEMA get it filled in
+    columns = sorted(set().union(*(
+        (name[:-4] for name in os.listdir(path) if name.endswith(".npy")) for path in parts
+    )))
+    pieces = [read_part(path, columns) for path in parts]
+    corridors = sorted(set().union(*(names for names, _ in pieces)))
+    index = {name: i for i, name in enumerate(corridors)}
+    for names, data in pieces:
+        data["corridor"] = np.array([index[n] for n in names], dtype=np.int32)[data["corridor"]]
+    merged = {name: np.concatenate([data[name] for _, data in pieces]) for name in pieces[0][1]}
+    order = np.lexsort((merged["timestamp"], merged["corridor"]))
+    return corridors, {name: values[order] for name, values in merged.items()}, parts
+
+
+def scan(store=STORE_DIR, columns=None, start=None, end=None, corridors=None, predicates=(), tier=RAW_TIER):
+    """
+    Read observations as a DataFrame.
+
+    start / end prune date partitions and bound the timestamp; corridors prunes
+    parts and row ranges; predicates is a list of (column, op, value) applied
+    inside each part (pushdown) before the projected columns are collected.
+    Include 'corridor' in columns to get the corridor id as a categorical.
+    """
+    columns = list(columns) if columns is not None else ["corridor"] + list(SCHEMA)
+    needed = list(dict.fromkeys(columns + [c for c, _, _ in predicates] + ["timestamp"]))
+    wanted = set(corridors) if corridors else None
+    lo = pd.Timestamp(start).value if start is not None else None
+    hi = pd.Timestamp(end).value if end is not None else None
+
+    pieces = {name: [] for name in columns}
+    all_names = {}
+    for _, directory in date_partitions(store, tier, start, end):
+        for path in part_dirs(directory):
+            part = read_part(path, needed, wanted)
+            if part is None:
+                continue
+            names, data = part
+            # No mask (and no copy) for parts that every row passes
+            mask = None
+            if lo is not None and data["timestamp"][:1].size and data["timestamp"].min() < lo:
+                mask = data["timestamp"] >= lo
+            if hi is not None and data["timestamp"][:1].size and data["timestamp"].max() >= hi:
+                mask = (data["timestamp"] < hi) if mask is None else mask & (data["timestamp"] < hi)
+            for column, op, value in predicates:
+                mask = OPS[op](data[column], value) if mask is None else mask & OPS[op](data[column], value)
+            if mask is not None and not mask.any():
+                continue
+            for name in columns:
+                values = data[name] if mask is None else data[name][mask]
+                if name == "corridor":
+                    # Re-code into one global category list
+                    lookup = np.array([all_names.setdefault(n, len(all_names)) for n in names], dtype=np.int32)
+                    values = lookup[values]
+                pieces[name].append(values)
+
+    out = {}
+    for name in columns:
+        dtype = np.int32 if name == "corridor" else SCHEMA.get(name, np.float64)
+        out[name] = np.concatenate(pieces[name]) if pieces[name] else np.empty(0, dtype=dtype)
+    if "timestamp" in out:
+        out["timestamp"] = out["timestamp"].view("datetime64[ns]")
+    if "corridor" in out:
+        out["corridor"] = pd.Categorical.from_codes(out["corridor"], list(all_names))
+    return pd.DataFrame(out)
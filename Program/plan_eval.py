@@ -0,0 +1,253 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from emission_hotspots import DEFAULT_BBOX, co2_grams_per_km, haversine_m
+from route_logs import find_logs, hourly_delay_ratios, load_route_logs
+
+# =========================
+# Batch evaluator for fleet delivery plans
+# =========================
+# Scores many candidate plans at once for optimisers that call it in their
+# inner loop. Cost model after the cold-chain papers in Papers/ ("Low-carbon
+# routing for cold-chain logistics considering the time-dependent effects of
+# traffic congestion", "Vehicle routing problem in cold chain logistics: a
+# joint distribution model with carbon trading mechanisms"):
+#
+#   fixed          per vehicle used
+#   fuel           load-dependent L/km, scaled by the speed curve of the leg
+#   refrigeration  L/h while driving and (doors opening) while serving
+#   damage         cargo value lost at rate DAMAGE_PER_HOUR while on board
+#   lateness       per minute after a customer's time window
+#   carbon         (CO2 - quota) x price; negative when allowances are sold
+#
+# Travel time is free-flow minutes times the logged congestion ratio for the
+# hour in which each leg departs.
+#
+# Plans are int arrays (plans, vehicles, stops) of customer indices, padded
+# with -1 anywhere; the depot (node 0) is implicit at both ends. Padding is
+# moved behind each route's stops and becomes depot -> depot legs of zero
+# length that add no cost, so every position is evaluated with the same array
+# operations, one loop step per stop across the whole batch, and the score
+# does not depend on the padding width.
+#
+# Usage:
+#   python plan_eval.py bench --plans 100000 --vehicles 5 --stops 8
+#   python plan_eval.py evaluate --instance instance.json --plans plans.npy --out scores.csv
+
+COSTS = {
+    "fixed_per_vehicle": 300.0,
+    "fuel_price_per_l": 30.0,
+    "capacity_kg": 2000.0,
+    "fuel_empty_l_per_km": 0.12,
+    "fuel_full_l_per_km": 0.20,
+    "reference_speed_kmh": 50.0,
+    "refrigeration_l_per_hour_driving": 0.8,
+    "refrigeration_l_per_hour_service": 1.2,
+    "co2_kg_per_l": 2.61,
+    "cargo_value_per_kg": 100.0,
+    "damage_per_hour": 0.002,
+    "lateness_per_minute": 5.0,
+    "carbon_price_per_kg": 0.3,
+    "carbon_quota_kg": 200.0,
+}
+COST_COLUMNS = ["fixed", "fuel", "refrigeration", "damage", "lateness", "carbon"]
+
+
+def hourly_ratio_profile(ratios):
+    """Mean logged congestion ratio per hour of day (pooled), 1.0 where an hour has no data."""
+    return np.array([h.mean() if len(h) else 1.0 for h in ratios[None]])
+
+
+def make_instance(distance_km, free_minutes, demand_kg, service_minutes, windows, hourly_ratio):
+    """
+    Instance arrays; node 0 is the depot. windows is (nodes, 2) earliest / latest
+    arrival in minutes after midnight, hourly_ratio has 24 entries.
+    """
+    distance_km = np.asarray(distance_km, dtype=float)
+    n = len(distance_km)
+    return {
+        "n_nodes": n,
+        "distance": distance_km.ravel(),
+        "minutes": np.asarray(free_minutes, dtype=float).ravel(),
+        "demand": np.asarray(demand_kg, dtype=float),
+        "service": np.asarray(service_minutes, dtype=float),
+        "earliest": np.asarray(windows, dtype=float)[:, 0],
+        "latest": np.asarray(windows, dtype=float)[:, 1],
+        # Minute resolution lookup avoids a division per leg
+        "ratio_by_minute": np.repeat(np.asarray(hourly_ratio, dtype=float), 60),
+    }
+
+
+def evaluate(plans, departures, instance, costs=COSTS):
+    """
+    Score a batch of plans in one vectorised pass.
+    plans: int (plans, vehicles, stops), -1 padded; departures: minutes after
+    midnight, broadcastable to (plans, vehicles). Returns a DataFrame with one
+    row per plan: the COST_COLUMNS, total, co2_kg, distance_km, duration_minutes
+    and overload_kg (load above capacity, summed over vehicles).
+    """
+    c = costs
+    plans = np.asarray(plans)
+    n_plans, n_vehicles, n_stops = plans.shape
+    routes = plans.reshape(-1, n_stops)
+    pad = routes < 0
+    if (pad[:, :-1] & ~pad[:, 1:]).any():
+        # Stops first, padding last (stable, so the visiting order is kept)
+        routes = np.take_along_axis(routes, np.argsort(pad, axis=1, kind="stable"), axis=1)
+    routes = np.maximum(routes, 0)
+    # Trailing depot column: the return leg
+    nodes = np.concatenate([routes, np.zeros((len(routes), 1), dtype=routes.dtype)], axis=1)
+    clock = np.broadcast_to(np.asarray(departures, dtype=float), (n_plans, n_vehicles)).ravel().copy()
+    start = clock.copy()
+
+    demand = instance["demand"][nodes]
+    load = demand.sum(axis=1)
+    overload = np.maximum(load - c["capacity_kg"], 0)
+    fuel_slope = (c["fuel_full_l_per_km"] - c["fuel_empty_l_per_km"]) / c["capacity_kg"]
+    ef_reference = co2_grams_per_km(c["reference_speed_kmh"])
+    n_nodes = instance["n_nodes"]
+
+    distance = np.zeros(len(nodes))
+    fuel = np.zeros(len(nodes))
+    driving = np.zeros(len(nodes))
+    serving = np.zeros(len(nodes))
+    late = np.zeros(len(nodes))
+    cargo_hours = np.zeros(len(nodes))
+    previous = np.zeros(len(nodes), dtype=nodes.dtype)
+    for k in range(n_stops + 1):
+        node = nodes[:, k]
+        arc = previous * n_nodes + node
+        km = instance["distance"][arc]
+        minute = clock.astype(np.int64) % (24 * 60)
+        travel = instance["minutes"][arc] * instance["ratio_by_minute"][minute]
+        speed = np.where(travel > 0, km / np.maximum(travel, 1e-9) * 60, c["reference_speed_kmh"])
+        fuel += km * (c["fuel_empty_l_per_km"] + fuel_slope * load) * co2_grams_per_km(speed) / ef_reference
+        cargo_hours += load * travel / 60
+        distance += km
+        driving += travel
+
+        arrive = clock + travel
+        # Padding legs (depot -> depot) are not visits: no lateness at the depot
+        visit = (previous != 0) | (node != 0)
+        late += np.where(visit, np.maximum(arrive - instance["latest"][node], 0), 0)
+        service = instance["service"][node]
+        cargo_hours += load * service / 60
+        clock = np.maximum(arrive, instance["earliest"][node]) + service
+        serving += service
+        load = load - demand[:, k]
+        previous = node
+
+    used = (routes > 0).any(axis=1)
+    refrigeration_l = (
+        c["refrigeration_l_per_hour_driving"] * driving + c["refrigeration_l_per_hour_service"] * serving
+    ) / 60
+    duration = np.where(used, clock - start, 0)
+
+    def per_plan(values):
+        return values.reshape(n_plans, n_vehicles).sum(axis=1)
+
+    co2 = per_plan((fuel + refrigeration_l) * c["co2_kg_per_l"])
+    out = pd.DataFrame(
+        {
+            "fixed": per_plan(used * c["fixed_per_vehicle"]),
+            "fuel": per_plan(fuel * c["fuel_price_per_l"]),
+            "refrigeration": per_plan(refrigeration_l * c["fuel_price_per_l"]),
+            "damage": per_plan(cargo_hours * c["damage_per_hour"] * c["cargo_value_per_kg"]),
+            "lateness": per_plan(late * c["lateness_per_minute"]),
+            "carbon": (co2 - c["carbon_quota_kg"]) * c["carbon_price_per_kg"],
+        }
+    )
+    out["total"] = out[COST_COLUMNS].sum(axis=1)
+    out["co2_kg"] = co2
+    out["distance_km"] = per_plan(distance)
+    out["duration_minutes"] = per_plan(duration)
+    out["overload_kg"] = per_plan(overload)
+    return out
+
+
+def random_instance(n_customers=50, seed=0, hourly_ratio=None, speed_kmh=30.0):
+    """Customers scattered over the Taipei basin, for benchmarks and tests."""
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(DEFAULT_BBOX[0], DEFAULT_BBOX[2], n_customers + 1)
+    lng = rng.uniform(DEFAULT_BBOX[1], DEFAULT_BBOX[3], n_customers + 1)
+    km = haversine_m(lat[:, None], lng[:, None], lat[None, :], lng[None, :]) / 1000 * 1.3
+    demand = np.r_[0, rng.uniform(50, 300, n_customers)]
+    service = np.r_[0, rng.uniform(5, 20, n_customers)]
+    open_at = rng.uniform(8 * 60, 14 * 60, n_customers)
+    windows = np.c_[np.r_[0, open_at], np.r_[24 * 60, open_at + 120]]
+    ratio = np.ones(24) if hourly_ratio is None else hourly_ratio
+    return make_instance(km, km / speed_kmh * 60, demand, service, windows, ratio)
+
+
+def random_plans(n_plans, n_vehicles, n_stops, n_customers, seed=0):
+    """Random plans: shuffled customers dealt to vehicles, with ragged -1 padding."""
+    rng = np.random.default_rng(seed)
+    per_plan = n_vehicles * n_stops
+    plans = np.argsort(rng.random((n_plans, n_customers)), axis=1)[:, :per_plan] + 1
+    plans = plans.reshape(n_plans, n_vehicles, n_stops)
+    lengths = rng.integers(1, n_stops + 1, (n_plans, n_vehicles, 1))
+    return np.where(np.arange(n_stops) < lengths, plans, -1)
+
+
+def benchmark(n_plans=100000, n_vehicles=5, n_stops=8, n_customers=50, hourly_ratio=None):
+    instance = random_instance(n_customers, hourly_ratio=hourly_ratio)
+    plans = random_plans(n_plans, n_vehicles, n_stops, n_customers)
+    departures = np.full(n_vehicles, 8 * 60.0)
+    evaluate(plans[:1000], departures, instance)  # warm-up
+    t0 = time.perf_counter()
+    evaluate(plans, departures, instance)
+    elapsed = time.perf_counter() - t0
+    return {"plans": n_plans, "seconds": round(elapsed, 3), "plans_per_second": int(n_plans / elapsed)}
+
+
+def load_instance(path, hourly_ratio):
+    """
+    instance.json: {"distance_km": [[...]], "free_minutes": [[...]], "demand_kg": [...],
+    "service_minutes": [...], "windows": [[earliest, latest], ...]} with node 0 the depot.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return make_instance(
+        data["distance_km"], data["free_minutes"], data["demand_kg"], data["service_minutes"],
+        data["windows"], hourly_ratio,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Batch cost / emission evaluation of fleet route plans.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("evaluate", help="Score plans for an instance")
+    p.add_argument("--instance", required=True, help="Instance JSON")
+    p.add_argument("--plans", required=True, help=".npy int array (plans, vehicles, stops), -1 padded")
+    p.add_argument("--departure", default="08:00", help="Departure time of every vehicle")
+    p.add_argument("--out", help="Write scores as CSV")
+
+    p = sub.add_parser("bench", help="Plans per second on random plans")
+    p.add_argument("--plans", type=int, default=100000)
+    p.add_argument("--vehicles", type=int, default=5)
+    p.add_argument("--stops", type=int, default=8)
+    p.add_argument("--customers", type=int, default=50)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    hourly_ratio = hourly_ratio_profile(hourly_delay_ratios(load_route_logs(find_logs())))
+    if args.command == "bench":
+        print(benchmark(args.plans, args.vehicles, args.stops, args.customers, hourly_ratio))
+        return
+    instance = load_instance(args.instance, hourly_ratio)
+    hours, minutes = args.departure.split(":")
+    scores = evaluate(np.load(args.plans), int(hours) * 60 + int(minutes), instance)
+    if args.out:
+        scores.to_csv(args.out, index=False)
+    print(scores.describe().T.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from route_logs import CONGESTION_THRESHOLDS, classify_delay, find_logs, load_route_logs
+
+# =========================
+# Incremental travel-time / delay predictor
+# =========================
+# Per-corridor linear model (cf. Papers/Urban transport emission prediction
+# analysis through machine.pdf) for duration_with_traffic and
+# difference_percent, with features
+#
+#   bias, static duration, time-of-day harmonics (2), weekend,
+#   lag delay / lag percent of the corridor's last observation, faded by age
+#
+# Training keeps the ridge sufficient statistics A = X'X + rI and b = X'y of
+# every corridor, so each new batch of logs is added in one vectorised pass
+# (no refit), and A / b are solved for all corridors at once when predicting.
+# The prior is "duration = static duration, no delay", so new corridors start
+# from the no-traffic estimate. Errors of each prediction made before its
+# update (prequential) feed an EWMA of the squared error, which gives the
+# confidence used to decide whether the scheduler may skip an API call.
+#
+# Usage:
+#   python predictor.py train --model predictor.npz              # new logs only are learned
+#   python predictor.py predict --model predictor.npz --departures 2025-10-06T08:00 2025-10-06T18:00
+#   python predictor.py evaluate --interval-minutes 5            # accuracy and call savings
+
+FEATURES = ["bias", "static", "tod_sin1", "tod_cos1", "tod_sin2", "tod_cos2", "weekend", "lag_delay", "lag_percent"]
+TARGETS = ["duration_with_traffic", "difference_percent"]
+RIDGE = 1.0
+LAG_TAU_MINUTES = 30
+ERROR_ALPHA = 0.05
+MIN_OBSERVATIONS = 50
+SKIP_TOLERANCE = 0.05  # max predicted duration error (std) relative to the prediction
+SKIP_Z = 1.64  # class threshold must be this many stds away from the predicted percent
+MAX_SKIP_MINUTES = 30  # always call again when the last real observation is older
+
+MINUTE_NS = 60_000_000_000
+DAY_NS = 24 * 60 * MINUTE_NS
+NO_TIME = np.iinfo(np.int64).min
+
+
+def features(timestamps, static, lag_age_minutes, lag_duration, lag_percent):
+    """
+    Feature matrix (n, len(FEATURES)). NaN lags count as fully faded, and so do
+    negative ages (a departure before the last observation has no usable lag).
+    """
+    ts = np.asarray(timestamps, dtype="datetime64[ns]").view(np.int64)
+    angle = 2 * np.pi * (ts % DAY_NS) / DAY_NS
+    weekend = ((ts // DAY_NS + 3) % 7 >= 5).astype(float)  # 1970-01-01 was a Thursday
+    age = np.asarray(lag_age_minutes, dtype=float)
+    age = np.where(age < 0, np.inf, np.nan_to_num(age, nan=np.inf))
+    fresh = np.exp(-age / LAG_TAU_MINUTES)
+    lag_delay = np.nan_to_num((lag_duration - static) * fresh)
+    lag_percent = np.nan_to_num(lag_percent * fresh)
+    return np.column_stack(
+        [np.ones(len(ts)), static, np.sin(angle), np.cos(angle), np.sin(2 * angle), np.cos(2 * angle),
+         weekend, lag_delay, lag_percent]
+    )
+
+
+def _group_sum(codes, values, n_groups):
+    """Sum rows of values (n, ...) per code into (n_groups, ...)."""
+    flat = values.reshape(len(codes), -1)
+    k = flat.shape[1]
+    idx = (codes[:, None] * k + np.arange(k)).ravel()
+    return np.bincount(idx, flat.ravel(), n_groups * k).reshape((n_groups,) + values.shape[1:])
+
+
+class DelayPredictor:
+    """Per-corridor online ridge regression over FEATURES for TARGETS."""
+
+    def __init__(self, ridge=RIDGE):
+        n_f, n_t = len(FEATURES), len(TARGETS)
+        self.ridge = ridge
+        self.corridors = []
+        self.index = {}
+        self.A = np.empty((0, n_f, n_f))
+        self.b = np.empty((0, n_f, n_t))
+        self.mse = np.empty((0, n_t))
+        self.count = np.empty(0, dtype=np.int64)
+        self.last_time = np.empty(0, dtype=np.int64)
+        self.last_static = np.empty(0)
+        self.last_values = np.empty((0, n_t))
+        self._weights = None
+
+    def _codes(self, corridors, add=False):
+        """Row of each corridor (-1 for unknown ones unless add)."""
+        corridors = list(corridors)
+        if add:
+            new = [c for c in dict.fromkeys(corridors) if c not in self.index]
+            if new:
+                self._grow(new)
+        return np.array([self.index.get(c, -1) for c in corridors], dtype=np.int64)
+
+    def _grow(self, new):
+        n, n_f, n_t = len(new), len(FEATURES), len(TARGETS)
+        prior = np.zeros((n_f, n_t))
+        prior[FEATURES.index("static"), TARGETS.index("duration_with_traffic")] = 1.0
+        for c in new:
+            self.index[c] = len(self.corridors)
+            self.corridors.append(c)
+        self.A = np.concatenate([self.A, np.broadcast_to(self.ridge * np.eye(n_f), (n, n_f, n_f))])
+        self.b = np.concatenate([self.b, np.broadcast_to(self.ridge * prior, (n, n_f, n_t))])
+        self.mse = np.concatenate([self.mse, np.full((n, n_t), np.nan)])
+        self.count = np.r_[self.count, np.zeros(n, dtype=np.int64)]
+        self.last_time = np.r_[self.last_time, np.full(n, NO_TIME)]
+        self.last_static = np.r_[self.last_static, np.full(n, np.nan)]
+        self.last_values = np.concatenate([self.last_values, np.full((n, n_t), np.nan)])
+        self._weights = None
+
+    def weights(self):
+        """(corridors, features, targets) ridge solution, solved for all corridors at once."""
+        if self._weights is None:
+            self._weights = np.linalg.solve(self.A, self.b)
+        return self._weights
+
+    def _lags(self, codes, ts):
+        known = self.last_time[codes] != NO_TIME
+        age = np.where(known, (ts - self.last_time[codes]) / MINUTE_NS, np.nan)
+        return age, self.last_values[codes, 0], self.last_values[codes, 1]
+
+    def predict_arrays(self, codes, timestamps, static=None):
+        """
+        Predictions for corridor rows codes (all known) at timestamps (int64 ns).
+        Returns (values (n, targets), std (n, targets), lag age in minutes).
+        """
+        static = self.last_static[codes] if static is None else np.where(np.isnan(static), self.last_static[codes], static)
+        age, lag_duration, lag_percent = self._lags(codes, timestamps)
+        X = features(timestamps, static, age, lag_duration, lag_percent)
+        values = np.einsum("nf,nft->nt", X, self.weights()[codes])
+        return values, np.sqrt(self.mse[codes]), age
+
+    def confident(self, codes, values, std, age, tolerance=SKIP_TOLERANCE, z=SKIP_Z,
+                  max_skip_minutes=MAX_SKIP_MINUTES):
+        """True where the prediction is good enough to skip the API call."""
+        duration, percent = values[:, 0], values[:, 1]
+        margin = np.min(np.abs(percent[:, None] - np.array(CONGESTION_THRESHOLDS)[None, :]), axis=1)
+        return (
+            (self.count[codes] >= MIN_OBSERVATIONS)
+            & (std[:, 0] <= tolerance * duration)
+            & (margin >= z * std[:, 1])
+            & (age <= max_skip_minutes)
+        )
+
+    def update_arrays(self, codes, timestamps, static, targets):
+        """
+        Add observations (codes, int64 ns timestamps, static durations, targets (n, 2)).
+        Rows not newer than their corridor's last observation are ignored, so
+        feeding the same logs twice does not count them twice.
+        """
+        keep = timestamps > self.last_time[codes]
+        codes, timestamps, static, targets = codes[keep], timestamps[keep], static[keep], targets[keep]
+        if not len(codes):
+            return 0
+        order = np.lexsort((timestamps, codes))
+        codes, timestamps, static, targets = codes[order], timestamps[order], static[order], targets[order]
+
+        # Lags: previous row of the same corridor, or the stored last observation
+        first = np.r_[True, codes[1:] != codes[:-1]]
+        age, lag_duration, lag_percent = self._lags(codes, timestamps)
+        prev = np.flatnonzero(~first)
+        age[prev] = (timestamps[prev] - timestamps[prev - 1]) / MINUTE_NS
+        lag_duration[prev] = targets[prev - 1, 0]
+        lag_percent[prev] = targets[prev - 1, 1]
+        X = features(timestamps, static, age, lag_duration, lag_percent)
+
+        # Prequential error: predict with the weights from before this batch
+        n_groups = len(self.corridors)
+        residual = targets - np.einsum("nf,nft->nt", X, self.weights()[codes])
+        n = np.bincount(codes, minlength=n_groups)
+        seen = n > 0
+        batch_mse = _group_sum(codes, residual**2, n_groups)[seen] / n[seen, None]
+        decay = (1 - ERROR_ALPHA) ** n[seen, None]
+        old = self.mse[seen]
+        self.mse[seen] = np.where(np.isnan(old), batch_mse, decay * old + (1 - decay) * batch_mse)
+
+        self.A += _group_sum(codes, X[:, :, None] * X[:, None, :], n_groups)
+        self.b += _group_sum(codes, X[:, :, None] * targets[:, None, :], n_groups)
+        self.count += n
+        last = np.flatnonzero(np.r_[codes[1:] != codes[:-1], True])
+        self.last_time[codes[last]] = timestamps[last]
+        self.last_static[codes[last]] = static[last]
+        self.last_values[codes[last]] = targets[last]
+        self._weights = None
+        return len(codes)
+
+    def update(self, df):
+        """Learn from normalised log rows (route_logs layout); returns rows used. Predicted rows are not learned."""
+        if "is_predicted" in df:
+            df = df[~df["is_predicted"]]
+        df = df.dropna(subset=["corridor", "timestamp", "duration_no_traffic"] + TARGETS)
+        if not len(df):
+            return 0
+        return self.update_arrays(
+            self._codes(df["corridor"], add=True),
+            df["timestamp"].to_numpy("datetime64[ns]").view(np.int64),
+            df["duration_no_traffic"].to_numpy(float),
+            df[TARGETS].to_numpy(float),
+        )
+
+    def predict(self, corridors, departures, static=None):
+        """
+        Predict every (corridor, departure) pair given as equal-length sequences.
+        Unknown corridors get NaN. Returns a DataFrame with the predictions,
+        their std, the congestion class and whether the API call can be skipped.
+        """
+        codes = self._codes(corridors)
+        ts = pd.to_datetime(pd.Series(departures)).to_numpy("datetime64[ns]").view(np.int64)
+        static = np.full(len(codes), np.nan) if static is None else np.asarray(static, dtype=float)
+        n_t = len(TARGETS)
+        values, std = np.full((len(codes), n_t), np.nan), np.full((len(codes), n_t), np.nan)
+        skip = np.zeros(len(codes), dtype=bool)
+        known = codes >= 0
+        if known.any():
+            v, s, age = self.predict_arrays(codes[known], ts[known], static[known])
+            values[known], std[known] = v, s
+            skip[known] = self.confident(codes[known], v, s, age)
+        out = pd.DataFrame({"corridor": list(corridors), "departure": ts.view("datetime64[ns]")})
+        for i, target in enumerate(TARGETS):
+            out[target] = values[:, i]
+            out[target + "_std"] = std[:, i]
+        out["congestion_class"] = classify_delay(out["difference_percent"])
+        out["skip"] = skip
+        return out
+
+    def save(self, path):
+        state = {name: getattr(self, name) for name in ("A", "b", "mse", "count", "last_time", "last_static", "last_values")}
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, corridors=np.array(self.corridors, dtype=str), ridge=self.ridge, **state)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = cls(float(data["ridge"]))
+            model.corridors = [str(c) for c in data["corridors"]]
+            model.index = {c: i for i, c in enumerate(model.corridors)}
+            for name in ("A", "b", "mse", "count", "last_time", "last_static", "last_values"):
+                setattr(model, name, data[name])
+        return model
+
+
+def evaluate(df, interval_minutes=5, model=None, **skip_options):
+    """
+    Replay logs tick by tick: predict every corridor due at a tick, skip the
+    calls the model is confident about (those rows are then never learned, as
+    in live use) and learn from the rest. Returns a one-row summary DataFrame.
+    """
+    model = model or DelayPredictor()
+    if "is_predicted" in df:
+        df = df[~df["is_predicted"]]
+    df = df.dropna(subset=["corridor", "timestamp", "duration_no_traffic"] + TARGETS)
+    codes = model._codes(df["corridor"], add=True)
+    ts = df["timestamp"].to_numpy("datetime64[ns]").view(np.int64)
+    static = df["duration_no_traffic"].to_numpy(float)
+    targets = df[TARGETS].to_numpy(float)
+
+    tick = ts // (interval_minutes * MINUTE_NS)
+    order = np.argsort(tick, kind="stable")
+    bounds = np.flatnonzero(np.r_[True, np.diff(tick[order]) != 0, True])
+    predicted = np.full(targets.shape, np.nan)
+    skipped = np.zeros(len(ts), dtype=bool)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        rows = order[lo:hi]
+        values, std, age = model.predict_arrays(codes[rows], ts[rows], static[rows])
+        predicted[rows] = values
+        skip = model.confident(codes[rows], values, std, age, **skip_options)
+        skipped[rows] = skip
+        called = rows[~skip]
+        model.update_arrays(codes[called], ts[called], static[called], targets[called])
+
+    error = predicted - targets
+    actual_class = classify_delay(targets[:, 1])
+    predicted_class = classify_delay(predicted[:, 1])
+    summary = {
+        "ticks": len(ts),
+        "corridors": len(np.unique(codes)),
+        "calls_saved_pct": 100 * skipped.mean(),
+        "duration_mae_min": np.abs(error[:, 0]).mean(),
+        "duration_mape_pct": 100 * np.abs(error[:, 0] / targets[:, 0]).mean(),
+        "percent_mae": np.abs(error[:, 1]).mean(),
+        "class_accuracy_pct": 100 * (actual_class == predicted_class).mean(),
+        "skipped_duration_mape_pct": 100 * np.abs(error[skipped, 0] / targets[skipped, 0]).mean() if skipped.any() else np.nan,
+        "skipped_class_accuracy_pct": 100 * (actual_class == predicted_class)[skipped].mean() if skipped.any() else np.nan,
+    }
+    return pd.DataFrame([summary]), model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Incremental travel-time and delay predictor.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("train", help="Update the model with route logs")
+    p.add_argument("logs", nargs="*", help="Route log files (default: Data/route_log_*.xlsx)")
+    p.add_argument("--model", default="predictor.npz", help="Model file (created if missing)")
+
+    p = sub.add_parser("predict", help="Predict corridors at departure times")
+    p.add_argument("--model", default="predictor.npz", help="Model file")
+    p.add_argument("--corridor", action="append", help="Corridor id (default: all known)")
+    p.add_argument("--departures", nargs="+", required=True, help="Departure times")
+    p.add_argument("--out", help="Write predictions as CSV")
+
+    p = sub.add_parser("evaluate", help="Replay logs and report accuracy and skipped calls")
+    p.add_argument("logs", nargs="*", help="Route log files (default: Data/route_log_*.xlsx)")
+    p.add_argument("--interval-minutes", type=int, default=5, help="Scheduler interval")
+    p.add_argument("--tolerance", type=float, default=SKIP_TOLERANCE, help="Max relative duration std to skip")
+    p.add_argument("--max-skip-minutes", type=float, default=MAX_SKIP_MINUTES, help="Force a call after this long")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "train":
+        model = DelayPredictor.load(args.model) if os.path.exists(args.model) else DelayPredictor()
+        used = model.update(load_route_logs(args.logs or find_logs()))
+        model.save(args.model)
+        print(f"{used} new observations learned, {len(model.corridors)} corridors in {args.model}")
+    elif args.command == "predict":
+        model = DelayPredictor.load(args.model)
+        corridors = args.corridor or model.corridors
+        pairs = [(c, d) for c in corridors for d in args.departures]
+        result = model.predict([c for c, _ in pairs], [d for _, d in pairs])
+        if args.out:
+            result.to_csv(args.out, index=False)
+        else:
+            print(result.to_string(index=False))
+    else:
+        summary, _ = evaluate(
+            load_route_logs(args.logs or find_logs()),
+            args.interval_minutes,
+            tolerance=args.tolerance,
+            max_skip_minutes=args.max_skip_minutes,
+        )
+        print(summary.T.to_string(header=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from route_logs import CONGESTION_CLASSES, classify_delay, corridor_key
+
+# =========================
+# Resident congestion probe service
+# =========================
+# Keeps one warm gRPC RoutesClient, a TTL cache and a recent-observation
+# buffer per corridor, and answers over a local HTTP (TCP or Unix socket) API:
+#
+#   GET  /congestion?corridor=NAME            current reading (cached for --ttl)
+#   GET  /congestion?olat=..&olng=..&dlat=..&dlng=..
+#   GET  /profile?corridor=NAME&days=weekday  hourly delay profile (weekday/weekend/all)
+#   POST /batch   {"pairs": [[olat, olng, dlat, dlng, (ilat, ilng, ...)], ...]} or {"corridors": [...]}
+#   GET  /stats                               cache hits, upstream calls, coalesced waits
+#
+# Simultaneous identical queries are coalesced onto one upstream call. Failed
+# calls (API errors, no route) answer 502 and are cached only for
+# --error-ttl, so a bad corridor does not hit the API on every request and
+# never enters the profile buffer. The cache and the buffers are bounded
+# (least recently used ad-hoc pairs go first; configured corridors keep their
+# buffers), so a resident service does not grow with every OD pair it sees.
+# Corridors with intermediate waypoints are one upstream call per reading,
+# which then carries per-leg records under "legs".
+#
+# Usage:
+#   python probe_service.py serve --port 8765 --corridors corridors.json
+#   python probe_service.py serve --unix /tmp/probe.sock
+#   python probe_service.py bench --url http://127.0.0.1:8765 --concurrency 32 --requests 5000
+#
+# corridors.json:
+#   {"neihu": {"origin": [25.080835, 121.565052], "destination": [25.068781, 121.584323]},
+#    "neihu_legs": {"origin": [...], "intermediates": [[25.0750, 121.5700], ...], "destination": [...]}}
+
+DEFAULT_PORT = 8765
+CACHE_TTL_SECONDS = 300
+ERROR_TTL_SECONDS = 30
+RECENT_OBSERVATIONS = 288  # one day at a 5 minute cadence
+MAX_CACHE_ENTRIES = 10_000
+MAX_RECENT_CORRIDORS = 1_000  # buffers of ad-hoc pairs beyond this are dropped, oldest first
+BATCH_WORKERS = 16
+UPSTREAM_TIMEOUT_SECONDS = 30
+
+
+class UpstreamError(Exception):
+    """The Routes API call failed or returned no route."""
+
+
+class ProbeService:
+    """Warm client + TTL cache + request coalescing around compute_congestion()."""
+
+    def __init__(self, corridors=None, ttl=CACHE_TTL_SECONDS, client=None, history=None,
+                 error_ttl=ERROR_TTL_SECONDS, max_cache=MAX_CACHE_ENTRIES, max_recent=MAX_RECENT_CORRIDORS):
+        self.corridors = corridors or {}
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.max_cache = max_cache
+        self.max_recent = max_recent
+        self._client = client
+        self._metadata = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._recent = OrderedDict()
+        self._named = {self.resolve(name=name)[0] for name in self.corridors}
+        self.history = history
+        self.stats = {"requests": 0, "cache_hits": 0, "upstream_calls": 0, "coalesced": 0, "errors": 0}
+        self._pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+
+    def _upstream(self, origin, destination, intermediates=()):
+        import routes_congestion_v2_grpc as probe
+
+        if self._client is None:
+            from google.maps.routing_v2.services.routes import RoutesClient
+
+            self._client = RoutesClient()
+        if self._metadata is None:
+            self._metadata = probe.build_metadata()
+        result = probe.compute_congestion(
+            self._client,
+            probe.build_waypoint(*origin),
+            probe.build_waypoint(*destination),
+            self._metadata,
+            [probe.build_waypoint(*point) for point in intermediates],
+        )
+        if result is None:
+            raise UpstreamError("No routes found in response.")
+        return _to_reading(result)
+
+    def resolve(self, name=None, origin=None, destination=None, intermediates=()):
+        """(key, origin, destination, intermediates) for a named corridor or an ad-hoc OD pair."""
+        if name is not None:
+            if name not in self.corridors:
+                raise KeyError(f"Unknown corridor: {name}")
+            origin = tuple(self.corridors[name]["origin"])
+            destination = tuple(self.corridors[name]["destination"])
+            intermediates = self.corridors[name].get("intermediates", ())
+        intermediates = tuple(tuple(point) for point in intermediates)
+        return corridor_key(origin, destination, intermediates), origin, destination, intermediates
+
+    def current(self, origin, destination, key=None, intermediates=()):
+        """Current reading for one OD pair (or waypoint corridor), from cache or one shared upstream call."""
+        if key is None:
+            key = corridor_key(origin, destination, intermediates)
+        now = time.monotonic()
+        with self._lock:
+            self.stats["requests"] += 1
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > now:
+                self.stats["cache_hits"] += 1
+                self._cache.move_to_end(key)
+                if isinstance(cached[1], Exception):
+                    raise cached[1]
+                return cached[1]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.stats["upstream_calls"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            return future.result(timeout=UPSTREAM_TIMEOUT_SECONDS)
+
+        try:
+            reading = self._upstream(origin, destination, intermediates)
+        except Exception as e:
+            error = e if isinstance(e, UpstreamError) else UpstreamError(str(e))
+            with self._lock:
+                self.stats["errors"] += 1
+                # Short negative cache; errors never go into _recent
+                self._cache[key] = (time.monotonic() + min(self.ttl, self.error_ttl), error)
+                self._cache.move_to_end(key)
+                self._trim()
+                del self._inflight[key]
+            future.set_exception(error)
+            raise error from e
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, reading)
+            self._cache.move_to_end(key)
+            if key not in self._recent:
+                self._recent[key] = deque(maxlen=RECENT_OBSERVATIONS)
+            self._recent.move_to_end(key)
+            self._recent[key].append(reading)
+            self._trim()
+            del self._inflight[key]
+        future.set_result(reading)
+        return reading
+
+    def _trim(self):
+        """Drop least recently used entries beyond the limits (call with the lock held)."""
+        while len(self._cache) > self.max_cache:
+            self._cache.popitem(last=False)
+        excess = len(self._recent) - self.max_recent
+        if excess > 0:
+            for key in list(islice((k for k in self._recent if k not in self._named), excess)):
+                del self._recent[key]
+
+    def batch(self, pairs):
+        """Look up many OD pairs concurrently; each pair is cached/coalesced as usual."""
+
+        def one(pair):
+            try:
+                intermediates = [tuple(pair[i : i + 2]) for i in range(4, len(pair), 2)]
+                return self.current(tuple(pair[:2]), tuple(pair[2:4]), intermediates=intermediates)
+            except Exception as e:
+                return {"error": str(e)}
+
+        return list(self._pool.map(one, pairs))
+
+    def profile(self, key, days="all"):
+        """Hourly mean / p90 delay percent from the log history plus live observations."""
+        hours = []
+        delays = []
+        weekdays = []
+        if self.history is not None:
+            rows = self.history[self.history["corridor"] == key].dropna(subset=["difference_percent"])
+            hours.append(rows["timestamp"].dt.hour.to_numpy())
+            delays.append(rows["difference_percent"].to_numpy())
+            weekdays.append(rows["timestamp"].dt.weekday.to_numpy())
+        with self._lock:
+            recent = [r for r in self._recent.get(key, ()) if r.get("difference_percent") is not None]
+        if recent:
+            hours.append(np.array([r["hour"] for r in recent]))
+            delays.append(np.array([r["difference_percent"] for r in recent]))
+            weekdays.append(np.array([r["weekday"] for r in recent]))
+        if not hours:
+            return []
+        hour = np.concatenate(hours)
+        delay = np.concatenate(delays)
+        weekday = np.concatenate(weekdays)
+        if days == "weekday":
+            keep = weekday < 5
+        elif days == "weekend":
+            keep = weekday >= 5
+        else:
+            keep = np.ones(len(hour), dtype=bool)
+        hour, delay = hour[keep], delay[keep]
+        profile = []
+        for h in np.unique(hour):
+            d = delay[hour == h]
+            profile.append(
+                {
+                    "hour": int(h),
+                    "count": int(len(d)),
+                    "mean_delay_percent": round(float(d.mean()), 2),
+                    "p90_delay_percent": round(float(np.percentile(d, 90)), 2),
+                }
+            )
+        return profile
+
+
+def _to_reading(result):
+    """JSON-friendly subset of a compute_congestion() result."""
+    percent = result["difference_percent"]
+    with_s = result["duration_seconds"]
+    no_s = result["duration_unaware_seconds"]
+    return {
+        "timestamp": result["time"].strftime("%Y-%m-%d %H:%M:%S"),
+        "hour": result["time"].hour,
+        "weekday": result["time"].weekday(),
+        "duration_with_traffic": round(with_s / 60, 2) if with_s else None,
+        "duration_no_traffic": round(no_s / 60, 2) if no_s else None,
+        "difference_percent": round(percent, 2) if percent is not None else None,
+        "congestion_status": (
+            CONGESTION_CLASSES[int(classify_delay(percent))] if percent is not None else None
+        ),
+        "distance_km": result["distance_km"],
+        "legs": [
+            {
+                "leg": leg["leg"],
+                "start": leg["start"],
+                "end": leg["end"],
+                "duration_with_traffic": round(leg["duration_seconds"] / 60, 2),
+                "duration_no_traffic": round(leg["static_duration_seconds"] / 60, 2),
+                "difference_percent": (
+                    round(leg["difference_percent"], 2) if leg["difference_percent"] is not None else None
+                ),
+                "distance_km": leg["distance_km"],
+            }
+            for leg in result.get("legs", [])
+        ],
+    }
+
+
+class ProbeHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a client reuses one connection (and one server thread)
+    protocol_version = "HTTP/1.1"
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _resolve(self, query):
+        if "corridor" in query:
+            return self.service.resolve(name=query["corridor"][0])
+        origin = (float(query["olat"][0]), float(query["olng"][0]))
+        destination = (float(query["dlat"][0]), float(query["dlng"][0]))
+        return self.service.resolve(origin=origin, destination=destination)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == "/congestion":
+                key, origin, destination, intermediates = self._resolve(query)
+                reading = self.service.current(origin, destination, key, intermediates)
+                self._send(200, {"corridor": key, **reading})
+            elif url.path == "/profile":
+                key, _, _, _ = self._resolve(query)
+                days = query.get("days", ["all"])[0]
+                self._send(200, {"corridor": key, "days": days, "profile": self.service.profile(key, days)})
+            elif url.path == "/stats":
+                self._send(200, self.service.stats)
+            else:
+                self._send(404, {"error": f"Unknown path: {url.path}"})
+        except (KeyError, ValueError) as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            # UpstreamError and anything else from the API call
+            self._send(502, {"error": str(e)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/batch":
+            self._send(404, {"error": f"Unknown path: {url.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("Body must be a JSON object")
+            pairs = list(payload.get("pairs", []))
+            for name in payload.get("corridors", []):
+                _, origin, destination, intermediates = self.service.resolve(name=name)
+                pairs.append([*origin, *destination, *(v for point in intermediates for v in point)])
+            self._send(200, {"results": self.service.batch(pairs)})
+        except (KeyError, ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+
+
+# The default listen backlog of 5 drops connections under concurrent load
+LISTEN_BACKLOG = 128
+
+
+class LocalHTTPServer(ThreadingHTTPServer):
+    request_queue_size = LISTEN_BACKLOG
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+def serve(service, port=DEFAULT_PORT, unix_path=None):
+    # Headers and body are separate writes; without TCP_NODELAY they stall on delayed ACKs
+    handler = type(
+        "Handler", (ProbeHandler,), {"service": service, "disable_nagle_algorithm": not unix_path}
+    )
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        server = ThreadingUnixHTTPServer(unix_path, handler)
+        print(f"Probe service listening on unix:{unix_path}")
+    else:
+        server = LocalHTTPServer(("127.0.0.1", port), handler)
+        print(f"Probe service listening on http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def measure_latency(url, path="/congestion?corridor=default", concurrency=32, requests=2000):
+    """Hit one endpoint from many keep-alive connections; returns latency percentiles in ms."""
+    target = urlparse(url)
+    per_client = max(1, requests // concurrency)
+
+    def client(_):
+        conn = HTTPConnection(target.hostname, target.port or 80)
+        latencies = []
+        for _ in range(per_client):
+            t0 = time.perf_counter()
+            conn.request("GET", path)
+            conn.getresponse().read()
+            latencies.append((time.perf_counter() - t0) * 1000)
+        conn.close()
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = np.concatenate([np.array(l) for l in pool.map(client, range(concurrency))])
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p90_ms": round(float(np.percentile(latencies, 90)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "max_ms": round(float(latencies.max()), 2),
+    }
+
+
+def load_corridors(path):
+    from routes_congestion_v2_grpc import DEFAULT_DESTINATION, DEFAULT_ORIGIN
+
+    corridors = {"default": {"origin": list(DEFAULT_ORIGIN), "destination": list(DEFAULT_DESTINATION)}}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            corridors.update(json.load(f))
+    return corridors
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resident congestion probe with a local query API.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("serve", help="Run the service")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port on 127.0.0.1")
+    p.add_argument("--unix", help="Listen on this Unix socket instead of TCP")
+    p.add_argument("--corridors", help="JSON file of named corridors")
+    p.add_argument("--ttl", type=int, default=CACHE_TTL_SECONDS, help="Cache TTL in seconds")
+    p.add_argument("--error-ttl", type=int, default=ERROR_TTL_SECONDS, help="Cache TTL of failed calls in seconds")
+    p.add_argument("--no-history", action="store_true", help="Do not load Data/route_log_*.xlsx for profiles")
+
+    p = sub.add_parser("bench", help="Measure latency under concurrent load")
+    p.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    p.add_argument("--path", default="/congestion?corridor=default")
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--requests", type=int, default=2000)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "bench":
+        print(measure_latency(args.url, args.path, args.concurrency, args.requests))
+        return
+
+    history = None
+    if not args.no_history:
+        from route_logs import load_route_logs
+
+        history = load_route_logs()
+    service = ProbeService(load_corridors(args.corridors), ttl=args.ttl, history=history, error_ttl=args.error_ttl)
+    serve(service, args.port, args.unix)
+
+
+if __name__ == "__main__":
+    main()
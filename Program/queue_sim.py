@@ -0,0 +1,269 @@
+import argparse
+import heapq
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from emission_hotspots import co2_grams_per_km
+from route_logs import find_logs, hourly_delay_ratios, load_route_logs
+
+# =========================
+# Refuelling queue simulation for green vehicle routing plans
+# =========================
+# Discrete-event simulation after "Green vehicle routing problem with queues":
+# vehicles drive their legs, stop at alternative-fuel stations and queue for a
+# free pump next to the station's background traffic (Poisson arrivals).
+# Leg travel time is the free-flow time times a congestion ratio drawn from
+# the logged ratios of that corridor at the hour the leg starts (pooled over
+# all corridors when the corridor has none). CO2 per leg uses the
+# speed-dependent curve of emission_hotspots.py.
+#
+# Events live in one heap of (time, seq, kind, id) tuples; vehicle and station
+# state are small arrays / deques. Replications are spread over processes in
+# chunks, each with its own seed, and reported per plan as mean / p50 / p90 /
+# p95 of waiting time, makespan, CO2 and refuel count.
+#
+# plans.json:
+#   {"stations": {"S1": {"pumps": 2, "refuel_minutes": 12, "refuel_cv": 0.3, "background_per_hour": 6}},
+#    "plans": {"A": [{"departure": "08:00", "ef_scale": 0.8,
+#                     "legs": [{"corridor": "25.0808,121.5651>25.0688,121.5843", "minutes": 8, "km": 3.2, "to": "S1"},
+#                              {"minutes": 20, "km": 12, "service_minutes": 10}]}]}}
+#
+# Usage:
+#   python queue_sim.py plans.json --replications 2000 --out queue_sim.csv
+
+ARRIVE, SERVICE_END, BACKGROUND_ARRIVAL, BACKGROUND_END = range(4)
+METRICS = ["wait_minutes", "max_wait_minutes", "makespan_minutes", "co2_kg", "refuels"]
+WARMUP_MINUTES = 120  # background traffic starts this long before the first departure
+CHUNK_REPLICATIONS = 100
+
+
+def _minutes(clock):
+    hours, minutes = clock.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def compile_plan(vehicles, station_index, ratio_index):
+    """Plan as per-vehicle tuples of legs (ratio table, free minutes, km, station or -1, service minutes)."""
+    compiled = []
+    for v in vehicles:
+        legs = []
+        for leg in v["legs"]:
+            if leg.get("to") is not None and leg["to"] not in station_index:
+                raise ValueError(f"Unknown station: {leg['to']}")
+            legs.append(
+                (
+                    ratio_index.get(leg.get("corridor"), 0),
+                    float(leg["minutes"]),
+                    float(leg["km"]),
+                    station_index[leg["to"]] if leg.get("to") is not None else -1,
+                    float(leg.get("service_minutes", 0)),
+                )
+            )
+        compiled.append((_minutes(v["departure"]), float(v.get("ef_scale", 1.0)), legs))
+    return compiled
+
+
+def compile_stations(stations):
+    names = list(stations)
+    return names, [
+        (
+            int(s.get("pumps", 1)),
+            float(s.get("refuel_minutes", 15)),
+            float(s.get("refuel_cv", 0.3)),
+            float(s.get("background_per_hour", 0)),
+        )
+        for s in stations.values()
+    ]
+
+
+def compile_ratios(ratios):
+    """Ratio tables as a list (index 0 = pooled) and a corridor -> index map."""
+    keys = [None] + [k for k in ratios if k is not None]
+    tables = []
+    for k in keys:
+        hours = ratios.get(k) or [np.empty(0)] * 24
+        # Hours without observations fall back to the pooled table, then to free flow
+        tables.append([h if len(h) else None for h in hours])
+    return tables, {k: i for i, k in enumerate(keys)}
+
+
+def simulate(plan, stations, tables, rng):
+    """One replication; returns the METRICS values."""
+    n = len(plan)
+    leg = np.zeros(n, dtype=np.int64)
+    wait = np.zeros(n)
+    co2 = np.zeros(n)
+    finish = np.zeros(n)
+    free = [s[0] for s in stations]
+    queues = [deque() for _ in stations]
+    events = []
+    counters = {"seq": 0, "remaining": n, "refuels": 0}
+
+    def push(t, kind, entity):
+        heapq.heappush(events, (t, counters["seq"], kind, entity))
+        counters["seq"] += 1
+
+    def drive(v, t):
+        """Start vehicle v's next leg at time t, or finish it."""
+        _, ef_scale, legs = plan[v]
+        if leg[v] >= len(legs):
+            finish[v] = t
+            counters["remaining"] -= 1
+            return
+        table, minutes, km, _, _ = legs[leg[v]]
+        hour = int(t // 60) % 24
+        samples = tables[table][hour]
+        if samples is None:
+            samples = tables[0][hour]
+        ratio = samples[rng.integers(len(samples))] if samples is not None else 1.0
+        travel = minutes * ratio
+        co2[v] += ef_scale * km * co2_grams_per_km(km / (travel / 60)) / 1000
+        push(t + travel, ARRIVE, v)
+
+    def serve(s, entity, t):
+        """Put entity (vehicle id, or -1 for background traffic) on a pump of station s."""
+        _, mean, cv, _ = stations[s]
+        if cv > 0:
+            shape = 1 / (cv * cv)
+            duration = rng.gamma(shape, mean / shape)
+        else:
+            duration = mean  # refuel_cv 0: fixed refuel time
+        if entity >= 0:
+            counters["refuels"] += 1
+            push(t + duration, SERVICE_END, entity)
+        else:
+            push(t + duration, BACKGROUND_END, s)
+
+    def arrive(s, entity, t):
+        if free[s] > 0:
+            free[s] -= 1
+            serve(s, entity, t)
+        else:
+            queues[s].append((entity, t))
+
+    def release(s, t):
+        """A pump of station s is free again: serve the head of its queue."""
+        if queues[s]:
+            entity, arrived = queues[s].popleft()
+            if entity >= 0:
+                wait[entity] += t - arrived
+            serve(s, entity, t)
+        else:
+            free[s] += 1
+
+    first_departure = min(p[0] for p in plan)
+    for v in range(n):
+        drive(v, plan[v][0])
+    for s, (_, _, _, rate) in enumerate(stations):
+        if rate > 0:
+            push(first_departure - WARMUP_MINUTES + rng.exponential(60 / rate), BACKGROUND_ARRIVAL, s)
+
+    while events and counters["remaining"]:
+        t, _, kind, entity = heapq.heappop(events)
+        if kind == ARRIVE:
+            _, _, _, station, service = plan[entity][2][leg[entity]]
+            if station >= 0:
+                arrive(station, entity, t)
+            else:
+                leg[entity] += 1
+                drive(entity, t + service)
+        elif kind == SERVICE_END:
+            station = plan[entity][2][leg[entity]][3]
+            leg[entity] += 1
+            drive(entity, t)
+            release(station, t)
+        elif kind == BACKGROUND_ARRIVAL:
+            arrive(entity, -1, t)
+            push(t + rng.exponential(60 / stations[entity][3]), BACKGROUND_ARRIVAL, entity)
+        else:
+            release(entity, t)
+
+    return wait.sum(), wait.max(initial=0), finish.max() - first_departure, co2.sum(), counters["refuels"]
+
+
+# Worker state, set once per process by _init_worker
+_WORKER = {}
+
+
+def _init_worker(plans, stations, tables):
+    _WORKER.update(plans=plans, stations=stations, tables=tables)
+
+
+def _run_chunk(task):
+    """count replications of every plan with one seed; returns {plan: (count, METRICS) array}."""
+    seed, count = task
+    rng = np.random.default_rng(seed)
+    return {
+        name: np.array([simulate(plan, _WORKER["stations"], _WORKER["tables"], rng) for _ in range(count)])
+        for name, plan in _WORKER["plans"].items()
+    }
+
+
+def run_replications(config, ratios, replications=1000, workers=None, seed=0):
+    """Simulate every plan replications times across processes; returns {plan: (replications, METRICS)}."""
+    station_names, stations = compile_stations(config.get("stations", {}))
+    station_index = {name: i for i, name in enumerate(station_names)}
+    tables, ratio_index = compile_ratios(ratios)
+    plans = {name: compile_plan(vehicles, station_index, ratio_index) for name, vehicles in config["plans"].items()}
+
+    n_chunks = -(-replications // CHUNK_REPLICATIONS)
+    counts = [CHUNK_REPLICATIONS] * (n_chunks - 1) + [replications - CHUNK_REPLICATIONS * (n_chunks - 1)]
+    tasks = list(zip(np.random.SeedSequence(seed).spawn(n_chunks), counts))
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _init_worker(plans, stations, tables)
+        chunks = [_run_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(plans, stations, tables)) as pool:
+            chunks = list(pool.map(_run_chunk, tasks))
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in plans}
+
+
+def summarise(results):
+    """Mean and percentiles of every metric per plan."""
+    rows = []
+    for name, values in results.items():
+        for i, metric in enumerate(METRICS):
+            column = values[:, i]
+            rows.append(
+                {
+                    "plan": name,
+                    "metric": metric,
+                    "mean": column.mean(),
+                    "p50": np.percentile(column, 50),
+                    "p90": np.percentile(column, 90),
+                    "p95": np.percentile(column, 95),
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Monte Carlo refuelling queue simulation of route plans.")
+    parser.add_argument("plans", help="Plans / stations JSON")
+    parser.add_argument("logs", nargs="*", help="Route log files for congestion ratios (default: Data/route_log_*.xlsx)")
+    parser.add_argument("--replications", type=int, default=1000, help="Replications per plan")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the summary as CSV")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.plans, encoding="utf-8") as f:
+        config = json.load(f)
+    ratios = hourly_delay_ratios(load_route_logs(args.logs or find_logs()))
+    summary = summarise(run_replications(config, ratios, args.replications, args.workers, args.seed))
+    if args.out:
+        summary.to_csv(args.out, index=False)
+    print(summary.to_string(index=False, float_format="{:.2f}".format))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from route_logs import find_logs, load_route_logs
+
+# =========================
+# Route geometry fingerprints and deduplicated polyline store
+# =========================
+# The same few polylines repeat thousands of times per corridor. Each tick's
+# encoded polyline is fingerprinted (8-byte blake2b) and every unique geometry
+# is decoded once and kept as delta-encoded int32 E5 coordinates; ticks only
+# reference the geometry id. Storage stays roughly flat over months and
+# "when did the route choice switch" is a diff over the ticks table.
+#
+# Store layout (one directory):
+#   geometries.npz  ids (uint64), offsets (int64, n + 1), deltas (int32, points x 2)
+#   ticks.csv       timestamp, corridor, geometry_id (hex)
+#
+# Usage:
+#   python route_geometry.py ingest --store geometry_store
+#   python route_geometry.py switches --store geometry_store [--corridor ID]
+#   python route_geometry.py bench
+
+GEOMETRY_FILE = "geometries.npz"
+TICKS_FILE = "ticks.csv"
+E5 = 1e5
+
+
+def fingerprint(encoded):
+    """64-bit fingerprint of an encoded polyline, as a 16-char hex string."""
+    return hashlib.blake2b(encoded.encode("ascii"), digest_size=8).hexdigest()
+
+
+def decode_polyline(encoded):
+    """Decode a Google encoded polyline into an (n, 2) array of lat/lng (pure Python)."""
+    coords = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        for axis in range(2):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if axis == 0:
+                lat += delta
+            else:
+                lng += delta
+        coords.append((lat / E5, lng / E5))
+    return np.array(coords, dtype=float).reshape(-1, 2)
+
+
+def decode_deltas(polylines):
+    """
+    Decode many encoded polylines in one vectorised pass.
+    Returns (deltas, offsets): int32 E5 deltas of shape (points, 2) where each
+    polyline's first row is its absolute start, and offsets of length n + 1.
+    """
+    polylines = list(polylines)
+    if not polylines:
+        return np.empty((0, 2), dtype=np.int32), np.zeros(1, dtype=np.int64)
+    chars = np.frombuffer("".join(polylines).encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if len(chars) == 0:
+        return np.empty((0, 2), dtype=np.int32), np.zeros(len(polylines) + 1, dtype=np.int64)
+
+    # A value ends at every chunk without the 0x20 continuation bit
+    is_end = (chars & 0x20) == 0
+    value_start = np.flatnonzero(np.r_[True, is_end[:-1]])
+    value_id = np.cumsum(np.r_[0, is_end[:-1]])
+    shift = 5 * (np.arange(len(chars)) - value_start[value_id])
+    raw = np.add.reduceat((chars & 0x1F) << shift, value_start)
+    delta = (raw >> 1) ^ -(raw & 1)
+
+    char_lengths = np.fromiter((len(p) for p in polylines), dtype=np.int64, count=len(polylines))
+    char_offsets = np.r_[0, np.cumsum(char_lengths)]
+    values_per_polyline = np.diff(np.r_[0, np.cumsum(is_end)][char_offsets])
+    offsets = np.r_[0, np.cumsum(values_per_polyline // 2)]
+    return delta.reshape(-1, 2).astype(np.int32), offsets
+
+
+def deltas_to_coords(deltas, offsets):
+    """Segmented cumulative sum: int32 deltas -> float lat/lng for every polyline."""
+    absolute = np.cumsum(deltas, axis=0, dtype=np.int64)
+    # Remove the running total carried over from the preceding polylines
+    starts = offsets[:-1]
+    carry = np.zeros((len(starts), 2), dtype=np.int64)
+    carry[starts > 0] = absolute[starts[starts > 0] - 1]
+    absolute -= np.repeat(carry, np.diff(offsets), axis=0)
+    return absolute / E5
+
+
+def decode_polylines(polylines):
+    """Decode many encoded polylines; returns a list of (n, 2) lat/lng arrays."""
+    deltas, offsets = decode_deltas(polylines)
+    coords = deltas_to_coords(deltas, offsets)
+    return [coords[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def load_store(store_dir):
+    path = os.path.join(store_dir, GEOMETRY_FILE)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            store = {k: data[k] for k in data.files}
+    else:
+        store = {
+            "ids": np.empty(0, dtype=np.uint64),
+            "offsets": np.zeros(1, dtype=np.int64),
+            "deltas": np.empty((0, 2), dtype=np.int32),
+        }
+    ticks_path = os.path.join(store_dir, TICKS_FILE)
+    if os.path.exists(ticks_path):
+        store["ticks"] = pd.read_csv(ticks_path, parse_dates=["timestamp"], dtype={"geometry_id": str})
+    else:
+        store["ticks"] = pd.DataFrame(columns=["timestamp", "corridor", "geometry_id"])
+    return store
+
+
+def _write_atomic(path, write):
+    """Write through a temp file so readers never see a half-written store."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def add_geometries(store, polylines):
+    """Decode and append polylines whose fingerprint is not in the store yet."""
+    known = {f"{i:016x}" for i in store["ids"]}
+    new = {}
+    for p in polylines:
+        fp = fingerprint(p)
+        if fp not in known and fp not in new:
+            new[fp] = p
+    if not new:
+        return 0
+    deltas, offsets = decode_deltas(new.values())
+    store["ids"] = np.r_[store["ids"], np.array([int(fp, 16) for fp in new], dtype=np.uint64)]
+    store["offsets"] = np.r_[store["offsets"], store["offsets"][-1] + offsets[1:]]
+    store["deltas"] = np.vstack([store["deltas"], deltas])
+    return len(new)
+
+
+def ingest(store_dir, df):
+    """Fingerprint the polylines of logged ticks and append them to the store."""
+    os.makedirs(store_dir, exist_ok=True)
+    store = load_store(store_dir)
+    df = df[df["polyline"].notna()]
+    added = add_geometries(store, df["polyline"].unique())
+
+    ticks = pd.DataFrame(
+        {
+            "timestamp": df["timestamp"].to_numpy(),
+            "corridor": df["corridor"].to_numpy(),
+            "geometry_id": df["polyline"].map(fingerprint).to_numpy(),
+        }
+    )
+    ticks = pd.concat([store["ticks"], ticks], ignore_index=True)
+    ticks = ticks.drop_duplicates(["timestamp", "corridor"]).sort_values(["corridor", "timestamp"])
+
+    geometry = {k: store[k] for k in ("ids", "offsets", "deltas")}
+    _write_atomic(os.path.join(store_dir, GEOMETRY_FILE), lambda f: np.savez(f, **geometry))
+    _write_atomic(os.path.join(store_dir, TICKS_FILE), lambda f: ticks.to_csv(f, index=False))
+    return added, len(ticks)
+
+
+def geometry_coords(store, geometry_id):
+    """lat/lng array of one stored geometry (hex id)."""
+    i = int(np.flatnonzero(store["ids"] == np.uint64(int(geometry_id, 16)))[0])
+    start, end = store["offsets"][i], store["offsets"][i + 1]
+    return np.cumsum(store["deltas"][start:end], axis=0, dtype=np.int64) / E5
+
+
+def route_switches(ticks, corridor=None):
+    """Ticks where a corridor's geometry differs from its previous tick."""
+    if corridor is not None:
+        ticks = ticks[ticks["corridor"] == corridor]
+    ticks = ticks.sort_values(["corridor", "timestamp"])
+    previous = ticks.groupby("corridor")["geometry_id"].shift()
+    switched = previous.notna() & (previous != ticks["geometry_id"])
+    return ticks.assign(previous_geometry_id=previous)[switched].reset_index(drop=True)
+
+
+def benchmark_decoder(n_polylines=2000, n_points=200, seed=0):
+    """Time the vectorised decoder against the pure-Python loop on random polylines."""
+    from emission_hotspots import DEFAULT_BBOX
+
+    rng = np.random.default_rng(seed)
+    polylines = []
+    for _ in range(n_polylines):
+        start = rng.uniform(DEFAULT_BBOX[:2], DEFAULT_BBOX[2:])
+        path = start + np.cumsum(rng.normal(0, 5e-4, (n_points, 2)), axis=0)
+        polylines.append(encode_polyline(path))
+
+    t0 = time.perf_counter()
+    reference = [decode_polyline(p) for p in polylines]
+    t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    vectorised = decode_polylines(polylines)
+    t_vec = time.perf_counter() - t0
+
+    assert all(np.allclose(a, b) for a, b in zip(reference, vectorised))
+    return {
+        "polylines": n_polylines,
+        "points": n_polylines * n_points,
+        "python_loop_s": t_loop,
+        "vectorised_s": t_vec,
+        "speedup": t_loop / t_vec,
+    }
+
+
+def encode_polyline(coords):
+    """Encode lat/lng pairs as a Google polyline (used to build benchmark inputs)."""
+    e5 = np.rint(np.asarray(coords) * E5).astype(np.int64)
+    deltas = np.diff(e5, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    out = []
+    for v in deltas:
+        v = ~(v << 1) if v < 0 else v << 1
+        while v >= 0x20:
+            out.append(chr((0x20 | (v & 0x1F)) + 63))
+            v >>= 5
+        out.append(chr(v + 63))
+    return "".join(out)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Route geometry fingerprinting and polyline store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="Add logged polylines to the store")
+    p.add_argument("logs", nargs="*", help="Route log files (default: Data/route_log_*.xlsx)")
+    p.add_argument("--store", default="geometry_store", help="Store directory")
+
+    p = sub.add_parser("switches", help="List ticks where the route geometry changed")
+    p.add_argument("--store", default="geometry_store", help="Store directory")
+    p.add_argument("--corridor", help="Only this corridor")
+
+    p = sub.add_parser("bench", help="Benchmark the vectorised polyline decoder")
+    p.add_argument("--polylines", type=int, default=2000)
+    p.add_argument("--points", type=int, default=200)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "ingest":
+        added, n_ticks = ingest(args.store, load_route_logs(args.logs or find_logs()))
+        print(f"{added} new geometries, {n_ticks} ticks in {args.store}")
+    elif args.command == "switches":
+        switches = route_switches(load_store(args.store)["ticks"], args.corridor)
+        print(switches.to_string(index=False) if len(switches) else "No route switches.")
+    else:
+        result = benchmark_decoder(args.polylines, args.points)
+        print(
+            f"{result['polylines']} polylines / {result['points']} points: "
+            f"loop {result['python_loop_s']:.3f}s, vectorised {result['vectorised_s']:.3f}s "
+            f"({result['speedup']:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# =========================
+# Route log loader
+# =========================
+# Reads the Excel files written by run_and_log_routes.py and returns one
+# normalised DataFrame that the analysis scripts can share.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data")
+LOG_PATTERN = "route_log_*.xlsx"
+
+# Same thresholds as routes_congestion_v2_grpc.py (percent extra travel time)
+CONGESTION_CLASSES = ["SMOOTH", "MODERATE", "SLOW", "SEVERE"]
+CONGESTION_THRESHOLDS = [10, 30, 60]
+
+NUMERIC_COLUMNS = [
+    "duration_with_traffic",
+    "duration_no_traffic",
+    "difference_seconds",
+    "difference_percent",
+    "distance_km",
+]
+
+SECONDS_REGEX = r"(\d+) seconds"
+POINT_REGEX = r"'latitude':\s*([-\d.eE]+),\s*'longitude':\s*([-\d.eE]+)"
+
+
+def find_logs(data_dir=DATA_DIR, pattern=LOG_PATTERN):
+    return sorted(glob.glob(os.path.join(data_dir, pattern)))
+
+
+def classify_delay(percent):
+    """Map delay percent to an index into CONGESTION_CLASSES (-1 if unknown)."""
+    percent = np.asarray(percent, dtype=float)
+    classes = np.digitize(percent, CONGESTION_THRESHOLDS)
+    return np.where(np.isnan(percent), -1, classes).astype(np.int8)
+
+
+def _via(intermediates):
+    """Key suffix for a waypoint corridor ('' without waypoints)."""
+    if not intermediates:
+        return ""
+    return " via " + ";".join(f"{lat:.4f},{lng:.4f}" for lat, lng in intermediates)
+
+
+def corridor_key(origin, destination, intermediates=()):
+    """
+    Corridor key of one OD pair, coordinates rounded to ~10 m:
+    'olat,olng>dlat,dlng', plus ' via lat,lng;...' when the route has waypoints.
+    corridor_id() is the same key for whole columns.
+    """
+    return f"{origin[0]:.4f},{origin[1]:.4f}>{destination[0]:.4f},{destination[1]:.4f}" + _via(intermediates)
+
+
+def corridor_id(origin_lat, origin_lng, dest_lat, dest_lng, intermediates=None):
+    """Stable corridor key (see corridor_key) for columns; intermediates holds each row's waypoints or None."""
+    parts = [
+        pd.Series(origin_lat).map("{:.4f}".format),
+        pd.Series(origin_lng).map("{:.4f}".format),
+        pd.Series(dest_lat).map("{:.4f}".format),
+        pd.Series(dest_lng).map("{:.4f}".format),
+    ]
+    key = parts[0] + "," + parts[1] + ">" + parts[2] + "," + parts[3]
+    if intermediates is not None:
+        key = key + pd.Series(list(intermediates), index=key.index).map(_via)
+    return key
+
+
+def log_intermediates(legs, waypoints=None):
+    """
+    Waypoints of each logged tick: the configured ones from its 'waypoints'
+    JSON, so the key matches probe_service's; ticks logged before that column
+    fall back to the API-snapped end of every leg but the last in 'legs'.
+    """
+    snapped = legs.map(
+        lambda text: [(leg["end_lat"], leg["end_lng"]) for leg in json.loads(text)[:-1]]
+        if isinstance(text, str) else None
+    )
+    if waypoints is None:
+        return snapped
+    configured = waypoints.map(
+        lambda text: [tuple(point) for point in json.loads(text)] if isinstance(text, str) else None
+    )
+    return configured.where(configured.notna(), snapped)
+
+
+def _split_point(series):
+    coords = series.astype("string").str.extract(POINT_REGEX)
+    return coords[0].astype(float), coords[1].astype(float)
+
+
+def normalise_log(df, source_file=None):
+    """Normalise one raw log sheet into the shared column layout."""
+    # Some early logs were written twice into the same sheet
+    df = df.loc[:, [c for c in df.columns if "." not in str(c)]].copy()
+
+    out = pd.DataFrame(index=df.index)
+    out["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+
+    origin_lat, origin_lng = _split_point(df.get("start_point", pd.Series(index=df.index)))
+    dest_lat, dest_lng = _split_point(df.get("end_point", pd.Series(index=df.index)))
+    coords = pd.DataFrame(
+        {
+            "origin_lat": origin_lat,
+            "origin_lng": origin_lng,
+            "dest_lat": dest_lat,
+            "dest_lng": dest_lng,
+        }
+    )
+    # Failed calls log empty points; they still belong to the file's corridor
+    coords = coords.ffill().bfill()
+    out = pd.concat([out, coords], axis=1)
+
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            out[col] = pd.to_numeric(df[col], errors="coerce")
+        else:
+            out[col] = np.nan
+    for col in ["duration_with_traffic", "duration_no_traffic"]:
+        if col in df.columns:
+            # Older logs kept the raw "465 seconds (7.75 minutes)" string
+            seconds = df[col].astype("string").str.extract(SECONDS_REGEX)[0].astype(float)
+            out[col] = out[col].fillna(seconds / 60)
+
+    status = df.get("congestion_status", pd.Series(index=df.index, dtype=object))
+    status_class = pd.Series(-1, index=df.index, dtype=np.int8)
+    for i, name in enumerate(CONGESTION_CLASSES):
+        status_class[status.astype("string").str.startswith(name).fillna(False)] = i
+    derived = classify_delay(out["difference_percent"])
+    out["congestion_class"] = np.where(status_class >= 0, status_class, derived).astype(np.int8)
+
+    for col in ["polyline", "speed_intervals", "legs", "waypoints"]:
+        out[col] = df[col].astype("string") if col in df.columns else pd.NA
+    # Ticks the logger skipped and filled from the predictor (run_and_log_routes --predictor)
+    out["is_predicted"] = df["is_predicted"].fillna(False).astype(bool) if "is_predicted" in df.columns else False
+
+    # Waypoint corridors get their own key: their baseline is the legs' static duration
+    out["corridor"] = corridor_id(
+        out["origin_lat"], out["origin_lng"], out["dest_lat"], out["dest_lng"],
+        log_intermediates(
+            out["legs"].astype(object).where(out["legs"].notna()),
+            out["waypoints"].astype(object).where(out["waypoints"].notna()),
+        ),
+    ).where(out["origin_lat"].notna())
+    out["source_file"] = os.path.basename(source_file) if source_file else None
+    return out.dropna(subset=["timestamp"])
+
+
+def load_route_logs(paths=None):
+    """Load and concatenate route logs (defaults to every log in Data/)."""
+    if paths is None:
+        paths = find_logs()
+    frames = []
+    for path in paths:
+        frames.append(normalise_log(pd.read_excel(path), source_file=path))
+    if not frames:
+        return normalise_log(pd.DataFrame(columns=["timestamp"]))
+    df = pd.concat(frames, ignore_index=True)
+    return df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+
+def expand_legs(df):
+    """
+    One row per leg for ticks logged with intermediate waypoints, in the same
+    layout as normalise_log(); each leg is its own corridor. Ticks without
+    legs, and predicted ticks (whose legs are the last real tick's), are left out.
+    """
+    rows = []
+    legs = df["legs"] if "is_predicted" not in df else df["legs"].where(~df["is_predicted"])
+    for i, legs in legs.dropna().items():
+        for leg in json.loads(legs):
+            rows.append({"row": i, **leg})
+    if not rows:
+        return df.iloc[0:0].assign(leg=pd.Series(dtype=np.int64), parent_corridor=pd.Series(dtype=object))
+    legs = pd.DataFrame(rows)
+    parent = df.loc[legs["row"]].reset_index(drop=True)
+
+    out = pd.DataFrame(
+        {
+            "timestamp": parent["timestamp"],
+            "origin_lat": legs["start_lat"],
+            "origin_lng": legs["start_lng"],
+            "dest_lat": legs["end_lat"],
+            "dest_lng": legs["end_lng"],
+            "duration_with_traffic": legs["duration_with_traffic"],
+            "duration_no_traffic": legs["duration_no_traffic"],
+            "distance_km": legs["distance_km"],
+        }
+    )
+    diff = out["duration_with_traffic"] - out["duration_no_traffic"]
+    out["difference_seconds"] = (diff * 60).round()
+    out["difference_percent"] = (diff / out["duration_no_traffic"] * 100).round(2)
+    out["congestion_class"] = classify_delay(out["difference_percent"])
+    out["polyline"] = pd.NA
+    out["speed_intervals"] = pd.NA
+    out["legs"] = pd.NA
+    out["waypoints"] = pd.NA
+    out["is_predicted"] = False
+    out["corridor"] = corridor_id(out["origin_lat"], out["origin_lng"], out["dest_lat"], out["dest_lng"])
+    out["source_file"] = parent["source_file"]
+    out["leg"] = legs["leg"]
+    out["parent_corridor"] = parent["corridor"]
+    return out
+
+
+def hourly_delay_ratios(df):
+    """
+    Logged duration_with_traffic / duration_no_traffic by hour of day:
+    {corridor: [24 arrays]}, with key None pooling every corridor.
+    """
+    ratio = df["duration_with_traffic"] / df["duration_no_traffic"]
+    rows = df.assign(ratio=ratio, hour=df["timestamp"].dt.hour)
+    rows = rows[np.isfinite(rows["ratio"]) & (rows["ratio"] > 0)]
+    empty = np.empty(0)
+    ratios = {None: [empty] * 24}
+    for hour, group in rows.groupby("hour"):
+        ratios[None][hour] = group["ratio"].to_numpy()
+    for (corridor, hour), group in rows.groupby(["corridor", "hour"]):
+        ratios.setdefault(corridor, [empty] * 24)[hour] = group["ratio"].to_numpy()
+    return ratios
@@ -0,0 +1,378 @@
+import argparse
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+import observation_store as store_lib
+from route_logs import find_logs, load_route_logs
+
+# =========================
+# Analytical queries over the route log history
+# =========================
+# Runs a small expression DSL or SQL over the columnar observation store
+# (observation_store.py). Corridor and timestamp conditions prune partitions,
+# the remaining conditions are pushed down into each partition scan, and only
+# the columns the query uses are read. Conditions on date / hour / weekday are
+# applied once those keys are derived from the timestamps.
+#
+# SQL copies the pruned rows into an in-memory sqlite table, with only the
+# columns the statement names (all of them for SELECT *), and percentile() is
+# a Python aggregate. Its cost grows with the rows loaded, about 2s per
+# million rows, so the sub-second target holds for the DSL only: prune SQL with
+# --start / --end / --corridor, or query a rollup --tier.
+#
+# DSL:
+#   <agg>(<column>)[, ...] [by <key>[, ...]] [where <column> <op> <value> [and ...]]
+#   aggs: count, sum, mean, min, max, median, p50 / p90 / p95 / p99 ...
+#   keys: corridor, date, hour, weekday, congestion_class
+#
+# Usage:
+#   python route_query.py ingest                      # Data/route_log_*.xlsx -> store
+#   python route_query.py query "p90(difference_percent) by weekday, hour where corridor = '25.0808,121.5651>25.0688,121.5843' and timestamp >= '2025-10-01' and timestamp < '2025-11-01'"
+#   python route_query.py query --sql "SELECT hour, percentile(difference_percent, 90) AS p90 FROM logs GROUP BY hour" --start 2025-10-01 --end 2025-11-01
+
+INGESTED_FILE = "ingested.txt"
+DERIVED_KEYS = {"date", "hour", "weekday"}
+KEY_RANGES = {"hour": 24, "weekday": 7}
+FAST_GROUPS = 2**15 - 1  # key combinations (plus a missing-key group) that fit an int16 id
+HOUR_NS = 3_600_000_000_000
+DAY_NS = 24 * HOUR_NS
+SELECT_ALL_REGEX = re.compile(r"select\s+(distinct\s+)?(\w+\.)?\*", re.I)
+AGG_REGEX = re.compile(r"^(\w+)\(\s*([\w*]*)\s*\)$")
+COND_REGEX = re.compile(r"^(\w+)\s*(<=|>=|!=|==|=|<|>)\s*(.+)$")
+
+
+def ingest(paths, store=store_lib.STORE_DIR):
+    """Append route log files to the store, skipping files ingested before."""
+    manifest = os.path.join(store, INGESTED_FILE)
+    done = set()
+    if os.path.exists(manifest):
+        with open(manifest, encoding="utf-8") as f:
+            done = set(line.strip() for line in f)
+    new = [p for p in paths if os.path.basename(p) not in done]
+    if not new:
+        return 0
+    rows = store_lib.append(load_route_logs(new), store)
+    with open(manifest, "a", encoding="utf-8") as f:
+        for p in new:
+            f.write(os.path.basename(p) + "\n")
+    return rows
+
+
+def _literal(text):
+    text = text.strip()
+    if text[:1] in "'\"" and text[-1:] == text[:1]:
+        return text[1:-1]
+    return float(text)
+
+
+def parse_dsl(expression):
+    """Parse the DSL into (aggs, keys, conditions)."""
+    split = re.split(r"\s+where\s+", expression.strip(), maxsplit=1, flags=re.I)
+    rest = split[0]
+    where = split[1] if len(split) > 1 else None
+    parts = re.split(r"\s+by\s+", rest, maxsplit=1, flags=re.I)
+    aggs = []
+    for item in parts[0].split(","):
+        match = AGG_REGEX.match(item.strip())
+        if not match:
+            raise ValueError(f"Bad aggregate: {item.strip()}")
+        func, column = match.group(1).lower(), match.group(2)
+        aggs.append((func, column if column not in ("", "*") else None))
+    keys = [k.strip() for k in parts[1].split(",")] if len(parts) > 1 else []
+    conditions = []
+    if where:
+        for cond in re.split(r"\s+and\s+", where, flags=re.I):
+            match = COND_REGEX.match(cond.strip())
+            if not match:
+                raise ValueError(f"Bad condition: {cond.strip()}")
+            conditions.append((match.group(1), match.group(2), _literal(match.group(3))))
+    return aggs, keys, conditions
+
+
+def plan(conditions):
+    """
+    Split conditions into partition pruning (start, end, corridors), pushed-down
+    column predicates and predicates on the derived keys.
+    """
+    start = end = None
+    corridors = None
+    predicates = []
+    derived = []
+    for column, op, value in conditions:
+        if column == "corridor":
+            if op not in ("=", "=="):
+                raise ValueError("Only corridor = '<id>' is supported")
+            corridors = [value]
+        elif column == "timestamp":
+            ts = pd.Timestamp(value)
+            if op in (">", ">="):
+                ts = ts + pd.Timedelta(1, "ns") if op == ">" else ts
+                start = ts if start is None else max(start, ts)
+            elif op in ("<", "<="):
+                ts = ts + pd.Timedelta(1, "ns") if op == "<=" else ts
+                end = ts if end is None else min(end, ts)
+            else:
+                start, end = ts, ts + pd.Timedelta(1, "ns")
+        elif column in DERIVED_KEYS:
+            derived.append((column, op, value))
+            if column == "date" and op != "!=":
+                # Also prune partitions; the filter on the derived key stays exact
+                day = pd.Timestamp(value).normalize()
+                if op in (">", ">=", "=", "=="):
+                    first = day + pd.Timedelta(1, "D") if op == ">" else day
+                    start = first if start is None else max(start, first)
+                if op in ("<", "<=", "=", "=="):
+                    stop = day if op == "<" else day + pd.Timedelta(1, "D")
+                    end = stop if end is None else min(end, stop)
+        else:
+            predicates.append((column, op, value))
+    return start, end, corridors, predicates, derived
+
+
+def _check_columns(names, store, tier):
+    """Raise ValueError for columns the tier does not store (the scan would fill them in silently)."""
+    known = set(store_lib.tier_columns(store, tier)) | DERIVED_KEYS | {"corridor"}
+    unknown = [name for name in dict.fromkeys(names) if name not in known]
+    if unknown:
+        raise ValueError(f"Unknown column(s) in tier {tier}: {', '.join(unknown)}")
+
+
+def _add_keys(df, keys):
+    if not DERIVED_KEYS.intersection(keys):
+        return df
+    # Integer arithmetic on the ns timestamps; the .dt accessors are several times slower.
+    # Hours since the epoch fit int32, which is cheaper to divide than int64.
+    hours = (df["timestamp"].to_numpy().view(np.int64) // HOUR_NS).astype(np.int32)
+    for key in keys:
+        if key == "date":
+            df["date"] = (hours // 24).astype("datetime64[D]")
+        elif key == "hour":
+            df["hour"] = (hours % 24).astype(np.int8)
+        elif key == "weekday":
+            df["weekday"] = ((hours // 24 + 3) % 7).astype(np.int8)  # 1970-01-01 was a Thursday
+    return df
+
+
+def _aggregate(values, func):
+    if func == "count":
+        return values.count()
+    if func == "median":
+        return values.median()
+    if re.fullmatch(r"p\d{1,2}", func):
+        return values.quantile(int(func[1:]) / 100)
+    if func in ("sum", "mean", "min", "max"):
+        return getattr(values, func)()
+    raise ValueError(f"Unknown aggregate: {func}")
+
+
+def _group_ids(df, keys):
+    """Combined int32 group id per row (-1 for missing keys) and the values of each key level."""
+    ids = np.zeros(len(df), dtype=np.int32)
+    levels = []
+    for key in keys:
+        column = df[key]
+        if key in KEY_RANGES:
+            codes, uniques = column.to_numpy(np.int32), np.arange(KEY_RANGES[key], dtype=column.dtype)
+        elif isinstance(column.dtype, pd.CategoricalDtype):
+            codes, uniques = column.cat.codes.to_numpy(np.int32), column.cat.categories
+        else:
+            codes, uniques = pd.factorize(column, sort=True)
+            codes = codes.astype(np.int32)
+        missing = (codes < 0) | (ids < 0)
+        ids = ids * len(uniques) + codes
+        if missing.any():
+            ids[missing] = -1
+        levels.append(uniques)
+    return ids, levels
+
+
+def _grouped(df, keys, aggs):
+    """
+    The aggregates per key combination in numpy, or None when there are too many
+    combinations. Rows are ordered by one radix sort of the int16 group ids and
+    every aggregate reduces contiguous slices, which is several times faster
+    than pandas' groupby quantile.
+    """
+    ids, levels = _group_ids(df, keys)
+    shape = [len(level) for level in levels]
+    n_groups = int(np.prod(shape))
+    if n_groups >= FAST_GROUPS:
+        return None
+    # Rows with a missing key go to an extra last group that is never reported
+    ids = np.where(ids < 0, n_groups, ids).astype(np.int16)
+    sizes = np.bincount(ids, minlength=n_groups + 1)
+    present = np.flatnonzero(sizes[:n_groups])
+    codes = np.unravel_index(present, shape)
+    out = pd.DataFrame({key: np.asarray(level)[c] for key, level, c in zip(keys, levels, codes)})
+
+    order = None
+    for func, column in aggs:
+        name = f"{func}({column or '*'})"
+        if column is None:
+            out[name] = sizes[present]
+            continue
+        values = df[column].to_numpy(np.float64)
+        nan = np.isnan(values)
+        has_nan = nan.any()
+        counts = sizes - np.bincount(ids[nan], minlength=n_groups + 1) if has_nan else sizes
+        if func == "count":
+            out[name] = counts[present]
+            continue
+        if func in ("sum", "mean"):
+            sums = np.bincount(ids, weights=np.where(nan, 0.0, values) if has_nan else values)[present]
+            out[name] = sums if func == "sum" else sums / np.where(counts[present], counts[present], np.nan)
+            continue
+        reduce = _slice_reducer(func)
+        if order is None:
+            order = np.argsort(ids, kind="stable")
+        values = values[order]
+        if has_nan:
+            values = values[~nan[order]]
+        bounds = np.r_[0, np.cumsum(counts)]
+        out[name] = np.array([reduce(values[bounds[g] : bounds[g + 1]]) if counts[g] else np.nan for g in present])
+    return out
+
+
+def _slice_reducer(func):
+    if func == "min":
+        return np.min
+    if func == "max":
+        return np.max
+    if func == "median":
+        return np.median
+    if re.fullmatch(r"p\d{1,2}", func):
+        q = int(func[1:]) / 100
+        return lambda values: np.quantile(values, q)
+    raise ValueError(f"Unknown aggregate: {func}")
+
+
+def run_dsl(expression, store=store_lib.STORE_DIR, tier=store_lib.RAW_TIER):
+    aggs, keys, conditions = parse_dsl(expression)
+    start, end, corridors, predicates, derived = plan(conditions)
+    _check_columns([c for _, c in aggs if c] + keys + [c for c, _, _ in conditions], store, tier)
+    columns = [c for _, c in aggs if c] + [k for k in keys if k not in DERIVED_KEYS]
+    if any(k in DERIVED_KEYS for k in keys) or any(c is None for _, c in aggs) or derived:
+        columns.append("timestamp")
+    df = store_lib.scan(store, list(dict.fromkeys(columns)), start, end, corridors, predicates, tier)
+    df = _add_keys(df, list(dict.fromkeys(keys + [c for c, _, _ in derived])))
+    if derived:
+        mask = np.ones(len(df), dtype=bool)
+        for column, op, value in derived:
+            mask &= store_lib.OPS[op](df[column], value).to_numpy()
+        df = df[mask].reset_index(drop=True)
+    if keys:
+        grouped = _grouped(df, keys, aggs)
+        if grouped is not None:
+            return grouped
+
+    results = {}
+    for func, column in aggs:
+        name = f"{func}({column or '*'})"
+        source = df[column] if column else df["timestamp"]
+        if keys:
+            source = source.groupby([df[k] for k in keys], observed=True)
+        results[name] = _aggregate(source, func)
+    if keys:
+        return pd.DataFrame(results).reset_index()
+    return pd.DataFrame([results])
+
+
+class _Percentile:
+    """sqlite aggregate: percentile(x, p) with p in 0-100."""
+
+    def __init__(self):
+        self.values = []
+        self.p = 50
+
+    def step(self, value, p):
+        if value is not None:
+            self.values.append(value)
+        self.p = p
+
+    def finalize(self):
+        return float(np.percentile(self.values, self.p)) if self.values else None
+
+
+def sql_columns(sql, store=store_lib.STORE_DIR, tier=store_lib.RAW_TIER):
+    """Columns of the 'logs' table a statement names, found by word match (all of them for SELECT *)."""
+    columns = store_lib.tier_columns(store, tier) + ["corridor", "date", "hour", "weekday"]
+    if SELECT_ALL_REGEX.search(sql):
+        return columns
+    words = set(re.findall(r"\w+", sql.lower()))
+    # COUNT(*) alone still needs a column to count the rows of
+    return [c for c in columns if c in words] or ["timestamp"]
+
+
+def run_sql(sql, store=store_lib.STORE_DIR, start=None, end=None, corridors=None, tier=store_lib.RAW_TIER):
+    """
+    Run SQL against a 'logs' table holding the pruned partitions.
+    Pruning comes from start / end / corridors, since SQL is not parsed here;
+    only the columns the statement names are loaded.
+    """
+    columns = sql_columns(sql, store, tier)
+    derived = [c for c in columns if c in DERIVED_KEYS]
+    stored = [c for c in columns if c not in DERIVED_KEYS]
+    if derived and "timestamp" not in stored:
+        stored.append("timestamp")
+    df = store_lib.scan(store, stored, start, end, corridors, tier=tier)
+    df = _add_keys(df, derived)[columns]
+    if "timestamp" in df:
+        df["timestamp"] = df["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    if "date" in df:
+        df["date"] = df["date"].astype(str)
+    if "corridor" in df:
+        df["corridor"] = df["corridor"].astype(str)
+    conn = sqlite3.connect(":memory:")
+    conn.create_aggregate("percentile", 2, _Percentile)
+    df.to_sql("logs", conn, index=False)
+    return pd.read_sql_query(sql, conn)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query the route log history.")
+    parser.add_argument("--store", default=store_lib.STORE_DIR, help="Observation store directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="Add route log files to the store")
+    p.add_argument("logs", nargs="*", help="Route log files (default: Data/route_log_*.xlsx)")
+
+    p = sub.add_parser("query", help="Run a DSL expression or --sql")
+    p.add_argument("expression", nargs="?", help="DSL expression")
+    p.add_argument("--sql", help="SQL over table 'logs' (loads every pruned row; see the header)")
+    p.add_argument("--start", help="Prune: first timestamp (SQL mode)")
+    p.add_argument("--end", help="Prune: end timestamp, exclusive (SQL mode)")
+    p.add_argument("--corridor", action="append", help="Prune: corridor id (SQL mode)")
+    p.add_argument("--tier", default=store_lib.RAW_TIER, help="Store tier to read")
+    p.add_argument("--out", help="Write the result as CSV")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "ingest":
+        rows = ingest(args.logs or find_logs(), args.store)
+        print(f"{rows} observations ingested into {args.store}")
+        return
+
+    t0 = time.perf_counter()
+    if args.sql:
+        result = run_sql(args.sql, args.store, args.start, args.end, args.corridor, args.tier)
+    elif args.expression:
+        result = run_dsl(args.expression, args.store, args.tier)
+    else:
+        raise SystemExit("Give a DSL expression or --sql")
+    elapsed = time.perf_counter() - t0
+    if args.out:
+        result.to_csv(args.out, index=False)
+    else:
+        print(result.to_string(index=False))
+    print(f"({len(result)} rows in {elapsed:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
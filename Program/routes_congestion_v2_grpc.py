@@ -14,6 +14,13 @@ API_KEY = os.getenv(
     "GOOGLE_MAPS_API_KEY", "YOUR_API_KEY"
 )  # <-- Replace with your actual API key or set env var
 
+# Request trafficCondition and other relevant fields
+FIELD_MASK = (
+    "routes.duration,routes.staticDuration,routes.distanceMeters,routes.routeLabels,routes.legs.startLocation,routes.legs.endLocation,"
+    "routes.polyline.encodedPolyline,routes.travelAdvisory.speedReadingIntervals,"
+    "routes.legs.duration,routes.legs.staticDuration,routes.legs.distanceMeters"
+)
+
 DEFAULT_ORIGIN = (25.080835, 121.565052)
 DEFAULT_DESTINATION = (25.068781, 121.584323)
 
@@ -27,86 +34,110 @@ def parse_duration(duration_pb):
     return getattr(duration_pb, "seconds", 0)
 
 
-def main():
-    if len(sys.argv) == 5:
-        try:
-            origin_lat = float(sys.argv[1])
-            origin_lng = float(sys.argv[2])
-            dest_lat = float(sys.argv[3])
-            dest_lng = float(sys.argv[4])
-            origin = build_waypoint(origin_lat, origin_lng)
-            destination = build_waypoint(dest_lat, dest_lng)
-        except Exception as e:
-            print("Invalid coordinates:", e)
-            return
-    else:
-        origin = build_waypoint(*DEFAULT_ORIGIN)
-        destination = build_waypoint(*DEFAULT_DESTINATION)
+def format_speed_intervals(intervals):
+    """Format speed reading intervals as 'start-end:SPEED;...' polyline point ranges."""
+    return ";".join(
+        f"{iv.start_polyline_point_index}-{iv.end_polyline_point_index}:{iv.speed.name}"
+        for iv in intervals
+    )
 
-    if not API_KEY or API_KEY == "YOUR_API_KEY":
-        print(
-            "U need export GOOGLE_MAPS_API_KEY= BALABALA "
+
+def format_point(lat_lng):
+    return f"{lat_lng.latitude:.6f},{lat_lng.longitude:.6f}"
+
+
+def leg_records(route):
+    """Per-leg duration, static duration and distance of a route with intermediates."""
+    legs = []
+    for i, leg in enumerate(route.legs, start=1):
+        duration_seconds = parse_duration(leg.duration)
+        static_seconds = parse_duration(leg.static_duration)
+        percent = None
+        if duration_seconds and static_seconds:
+            percent = (duration_seconds - static_seconds) / static_seconds * 100
+        legs.append(
+            {
+                "leg": i,
+                "start": format_point(leg.start_location.lat_lng),
+                "end": format_point(leg.end_location.lat_lng),
+                "duration_seconds": duration_seconds,
+                "static_duration_seconds": static_seconds,
+                "distance_km": leg.distance_meters / 1000,
+                "difference_percent": percent,
+                "congestion_status": classify_congestion(percent) if percent is not None else None,
+            }
         )
-        return
+    return legs
 
-    # gRPC client
-    client = RoutesClient()
 
-    # Request trafficCondition and other relevant fields
-    metadata = [
-        ("x-goog-api-key", API_KEY),
-        (
-            "x-goog-fieldmask",
-            "routes.duration,routes.staticDuration,routes.distanceMeters,routes.routeLabels,routes.legs.startLocation,routes.legs.endLocation",
-        ),
-    ]
+def build_metadata(api_key=API_KEY):
+    return [("x-goog-api-key", api_key), ("x-goog-fieldmask", FIELD_MASK)]
+
 
+def classify_congestion(percent):
+    if percent < 10:
+        return f"SMOOTH ({percent:.1f}%)"
+    elif percent < 30:
+        return f"MODERATE ({percent:.1f}%)"
+    elif percent < 60:
+        return f"SLOW ({percent:.1f}%)"
+    return f"SEVERE ({percent:.1f}%)"
+
+
+def compute_congestion(client, origin, destination, metadata, intermediates=None):
+    """
+    Query the traffic-aware and traffic-unaware routes and return the result as a dict.
+    Returns None when no route was found; API errors on the first call are raised.
+
+    With intermediates (ordered waypoints) a single traffic-aware request is
+    made and the no-traffic baseline is the route's static duration; the
+    result then carries one record per leg in "legs".
+    """
     request = ComputeRoutesRequest(
         origin=origin,
         destination=destination,
+        intermediates=intermediates or [],
         travel_mode=RouteTravelMode.DRIVE,
         routing_preference=RoutingPreference.TRAFFIC_AWARE,
         compute_alternative_routes=False,
+        extra_computations=[ComputeRoutesRequest.ExtraComputation.TRAFFIC_ON_POLYLINE],
         language_code="zh-TW",
         units="METRIC",
     )
-
-    try:
-        response = client.compute_routes(request=request, metadata=metadata)
-    except Exception as e:
-        print("API error:", e)
-        return
-
+    response = client.compute_routes(request=request, metadata=metadata)
     if not response.routes:
-        print("No routes found in response.")
-        return
+        return None
 
     route = response.routes[0]
-    leg = route.legs[0]
-    advisory = leg.travel_advisory
-
-    now = datetime.datetime.now()
-    start = MessageToDict(leg.start_location.lat_lng)
-    end = MessageToDict(leg.end_location.lat_lng)
-    distance_km = (
-        route.distance_meters / 1000 if hasattr(route, "distance_meters") else None
-    )
-    duration_seconds = parse_duration(route.duration)
-    duration_minutes = duration_seconds / 60 if duration_seconds else None
-    duration_unaware_seconds = None
-    duration_unaware_minutes = None
-
-    print("=== Google Maps Routes API Congestion Quantifier (gRPC version) ===")
-    print(f"Time: {now.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"From: {start}")
-    print(f"To:   {end}")
-    if distance_km is not None:
-        print(f"Distance: {distance_km:.2f} km")
-    if duration_seconds:
-        print(
-            f"Duration (with traffic): {duration_seconds} seconds ({duration_minutes:.2f} minutes)"
+    result = {
+        "time": datetime.datetime.now(),
+        "start": MessageToDict(route.legs[0].start_location.lat_lng),
+        "end": MessageToDict(route.legs[-1].end_location.lat_lng),
+        "distance_km": (
+            route.distance_meters / 1000 if hasattr(route, "distance_meters") else None
+        ),
+        "duration_seconds": parse_duration(route.duration),
+        "route_labels": [str(label) for label in route.route_labels],
+        "polyline": route.polyline.encoded_polyline or None,
+        "speed_intervals": format_speed_intervals(
+            route.travel_advisory.speed_reading_intervals
         )
-    print(f"Route labels: {[str(label) for label in route.route_labels]}")
+        or None,
+        "unaware_found": False,
+        "duration_unaware_seconds": None,
+        "difference_percent": None,
+        "congestion_status": None,
+        "error": None,
+        "legs": [],
+    }
+
+    if intermediates:
+        # One call per tick: every leg already has its static (no traffic) duration
+        result["legs"] = leg_records(route)
+        result["unaware_found"] = True
+        result["duration_unaware_seconds"] = parse_duration(route.static_duration)
+        set_difference(result)
+        return result
 
     # Show and compare with traffic and no traffic durations only
     request_unaware = ComputeRoutesRequest(
@@ -123,39 +154,108 @@ def main():
             request=request_unaware, metadata=metadata
         )
         if response_unaware.routes:
-            route_unaware = response_unaware.routes[0]
-            duration_unaware_seconds = parse_duration(route_unaware.duration)
-            duration_unaware_minutes = (
-                duration_unaware_seconds / 60 if duration_unaware_seconds else None
-            )
-            if duration_unaware_seconds:
-                print(
-                    f"Duration (no traffic): {duration_unaware_seconds} seconds ({duration_unaware_minutes:.2f} minutes)"
-                )
-            if duration_seconds and duration_unaware_seconds:
-                diff_aware_unaware = duration_seconds - duration_unaware_seconds
-                percent_aware_unaware = (
-                    diff_aware_unaware / duration_unaware_seconds
-                ) * 100
-
-                if percent_aware_unaware < 10:
-                    congestion_status = f"SMOOTH ({percent_aware_unaware:.1f}%)"
-                elif percent_aware_unaware < 30:
-                    congestion_status = f"MODERATE ({percent_aware_unaware:.1f}%)"
-                elif percent_aware_unaware < 60:
-                    congestion_status = f"SLOW ({percent_aware_unaware:.1f}%)"
-                else:
-                    congestion_status = f"SEVERE ({percent_aware_unaware:.1f}%)"
-                print(f"Traffic condition: {congestion_status}")
-        else:
+            result["unaware_found"] = True
+            duration_unaware_seconds = parse_duration(response_unaware.routes[0].duration)
+            result["duration_unaware_seconds"] = duration_unaware_seconds
+            set_difference(result)
+    except Exception as e:
+        result["error"] = e
+    return result
+
+
+def set_difference(result):
+    duration_seconds = result["duration_seconds"]
+    duration_unaware_seconds = result["duration_unaware_seconds"]
+    if duration_seconds and duration_unaware_seconds:
+        diff_aware_unaware = duration_seconds - duration_unaware_seconds
+        percent_aware_unaware = (diff_aware_unaware / duration_unaware_seconds) * 100
+        result["difference_percent"] = percent_aware_unaware
+        result["congestion_status"] = classify_congestion(percent_aware_unaware)
+
+
+def print_result(result):
+    duration_seconds = result["duration_seconds"]
+    duration_unaware_seconds = result["duration_unaware_seconds"]
+
+    print("=== Google Maps Routes API Congestion Quantifier (gRPC version) ===")
+    print(f"Time: {result['time'].strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"From: {result['start']}")
+    print(f"To:   {result['end']}")
+    if result["distance_km"] is not None:
+        print(f"Distance: {result['distance_km']:.2f} km")
+    if duration_seconds:
+        print(
+            f"Duration (with traffic): {duration_seconds} seconds ({duration_seconds / 60:.2f} minutes)"
+        )
+    print(f"Route labels: {result['route_labels']}")
+    if result["polyline"]:
+        print(f"Polyline: {result['polyline']}")
+    if result["speed_intervals"]:
+        print(f"Speed intervals: {result['speed_intervals']}")
+
+    if result["error"] is not None:
+        print("Error estimating traffic condition:", result["error"])
+    elif not result["unaware_found"]:
+        print(
+            "Could not estimate traffic condition (no route for traffic-unaware)."
+        )
+    else:
+        if duration_unaware_seconds:
             print(
-                "Could not estimate traffic condition (no route for traffic-unaware)."
+                f"Duration (no traffic): {duration_unaware_seconds} seconds ({duration_unaware_seconds / 60:.2f} minutes)"
             )
+        if result["congestion_status"]:
+            print(f"Traffic condition: {result['congestion_status']}")
+
+    for leg in result.get("legs", []):
+        status = leg["congestion_status"] or "unknown"
+        print(
+            f"Leg {leg['leg']}: {leg['start']} > {leg['end']} | "
+            f"{leg['duration_seconds']} s with traffic, {leg['static_duration_seconds']} s static, "
+            f"{leg['distance_km']:.2f} km | {status}"
+        )
+
+
+def main():
+    # Coordinates: origin, [intermediate waypoints...], destination as lat lng pairs
+    intermediates = []
+    if len(sys.argv) >= 5:
+        try:
+            if len(sys.argv) % 2 == 0:
+                raise ValueError("expected lat lng pairs")
+            values = [float(v) for v in sys.argv[1:]]
+            points = [build_waypoint(values[i], values[i + 1]) for i in range(0, len(values), 2)]
+            origin, destination = points[0], points[-1]
+            intermediates = points[1:-1]
+        except Exception as e:
+            print("Invalid coordinates:", e)
+            return
+    else:
+        origin = build_waypoint(*DEFAULT_ORIGIN)
+        destination = build_waypoint(*DEFAULT_DESTINATION)
+
+    if not API_KEY or API_KEY == "YOUR_API_KEY":
+        print(
+            "U need export GOOGLE_MAPS_API_KEY= BALABALA "
+        )
+        return
+
+    # gRPC client
+    client = RoutesClient()
+
+    try:
+        result = compute_congestion(
+            client, origin, destination, build_metadata(), intermediates
+        )
     except Exception as e:
-        print("Error estimating traffic condition:", e)
+        print("API error:", e)
+        return
+
+    if result is None:
+        print("No routes found in response.")
+        return
 
-    # For debugging, print the full advisory object
-    # print("TravelAdvisory:", MessageToDict(advisory))
+    print_result(result)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,5 @@
+import json
+import os
 import subprocess
 import time
 import pandas as pd
@@ -15,9 +17,11 @@ INTERVAL_MINUTES = None
 INTERVAL_SECONDS = None
 
 
-def run_script():
+def run_script(coords=()):
     """Run the congestion script and capture its output."""
-    result = subprocess.run(["python", SCRIPT_PATH], capture_output=True, text=True)
+    result = subprocess.run(
+        ["python", SCRIPT_PATH, *map(str, coords)], capture_output=True, text=True
+    )
     return result.stdout
 
 
@@ -42,7 +46,36 @@ def seconds_to_minutes_str(duration_str):
     return round(sec / 60, 2)
 
 
-def parse_output(output):
+LEG_REGEX = re.compile(
+    r"^Leg (\d+): ([-\d.]+),([-\d.]+) > ([-\d.]+),([-\d.]+) \| "
+    r"(\d+) s with traffic, (\d+) s static, ([\d.]+) km"
+)
+
+
+def parse_leg(line):
+    """One 'Leg n: ...' line as a dict with durations in minutes, or None."""
+    match = LEG_REGEX.match(line)
+    if not match:
+        return None
+    g = match.groups()
+    return {
+        "leg": int(g[0]),
+        "start_lat": float(g[1]),
+        "start_lng": float(g[2]),
+        "end_lat": float(g[3]),
+        "end_lng": float(g[4]),
+        "duration_with_traffic": round(int(g[5]) / 60, 2),
+        "duration_no_traffic": round(int(g[6]) / 60, 2),
+        "distance_km": float(g[7]),
+    }
+
+
+def parse_output(output, coords=()):
+    """
+    Parse the probe script's printout into a log row. coords are the --coords
+    it was run with; their intermediate points are logged as 'waypoints' (JSON)
+    and key the corridor, rather than the API-snapped ends of the legs.
+    """
     lines = output.splitlines()
     data = {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -53,7 +86,14 @@ def parse_output(output):
         "congestion_status": None,
         "difference_seconds": None,
         "difference_percent": None,
+        "distance_km": None,
+        "polyline": None,
+        "speed_intervals": None,
+        "legs": None,
+        "waypoints": None,
+        "is_predicted": False,
     }
+    legs = []
 
     for line in lines:
         if line.startswith("From:"):
@@ -68,6 +108,22 @@ def parse_output(output):
             data["duration_no_traffic"] = seconds_to_minutes_str(duration_str)
         elif "Traffic condition (estimated):" in line:
             data["congestion_status"] = line.split(":", 1)[1].strip()
+        elif line.startswith("Distance:"):
+            match = re.search(r"([\d.]+) km", line)
+            data["distance_km"] = float(match.group(1)) if match else None
+        elif line.startswith("Polyline:"):
+            data["polyline"] = line.split(":", 1)[1].strip()
+        elif line.startswith("Speed intervals:"):
+            data["speed_intervals"] = line.split(":", 1)[1].strip()
+        elif line.startswith("Leg "):
+            leg = parse_leg(line)
+            if leg:
+                legs.append(leg)
+    if legs:
+        data["legs"] = json.dumps(legs)
+    points = [list(coords[i : i + 2]) for i in range(0, len(coords) - 1, 2)]
+    if len(points) > 2:
+        data["waypoints"] = json.dumps(points[1:-1])
 
     min_with = data["duration_with_traffic"]
     min_no = data["duration_no_traffic"]
@@ -84,6 +140,71 @@ def parse_output(output):
     return data
 
 
+def log_to_store(data, store):
+    """Append the tick to the columnar observation store as a new part."""
+    import observation_store
+    from route_logs import normalise_log
+
+    observation_store.append(normalise_log(pd.DataFrame([data]), EXCEL_PATH), store)
+
+
+def predicted_skip(model, corridor):
+    """Prediction for the corridor now if the model is confident enough to skip the call."""
+    if model is None or corridor is None:
+        return None
+    prediction = model.predict([corridor], [datetime.now()]).iloc[0]
+    return prediction if prediction["skip"] else None
+
+
+def predicted_row(prediction, last):
+    """
+    Log row for a skipped tick: the corridor of the last real tick with the
+    predicted values, flagged is_predicted so later stages can tell it apart.
+    legs and waypoints are kept: the waypoints are part of the corridor key.
+    """
+    from route_logs import CONGESTION_CLASSES
+
+    data = dict(last)
+    duration = round(float(prediction["duration_with_traffic"]), 2)
+    no_traffic = data["duration_no_traffic"]
+    data.update(
+        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        duration_with_traffic=duration,
+        difference_percent=round(float(prediction["difference_percent"]), 2),
+        difference_seconds=int(round((duration - no_traffic) * 60)) if no_traffic else None,
+        congestion_status=f"{CONGESTION_CLASSES[prediction['congestion_class']]} (predicted)",
+        polyline=None,
+        speed_intervals=None,
+        is_predicted=True,
+    )
+    return data
+
+
+def learn_tick(model, data, model_path):
+    """Update the predictor with the tick just logged and save it."""
+    from route_logs import normalise_log
+
+    row = normalise_log(pd.DataFrame([data]), EXCEL_PATH)
+    model.update(row)
+    model.save(model_path)
+    return row["corridor"].iloc[0] if len(row) else None
+
+
+def detect_anomalies(detector, data, state_path=None, events_path=None):
+    """Score the tick against its corridor baseline and emit anomaly events; save the state if state_path is given."""
+    from anomaly_detector import emit
+    from route_logs import normalise_log
+
+    row = normalise_log(pd.DataFrame([data]), EXCEL_PATH).dropna(subset=["corridor"])
+    if not len(row):
+        return []
+    events = detector.observe(row["corridor"], row["timestamp"], row["difference_percent"])
+    emit(events, events_path)
+    if state_path:
+        detector.save(state_path)
+    return events
+
+
 def log_to_excel(data):
     """Append the parsed data to the Excel file."""
     try:
@@ -123,6 +244,43 @@ def parse_args():
         required=True,
         help="Additional interval seconds (e.g., 0)",
     )
+    parser.add_argument(
+        "--coords",
+        type=float,
+        nargs="+",
+        default=(),
+        help="Origin, intermediate waypoints and destination as lat lng pairs (one request, per-leg records)",
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=None,
+        help="Also append each tick to this observation store directory",
+    )
+    parser.add_argument(
+        "--predictor",
+        type=str,
+        default=None,
+        help="Predictor model file (predictor.py); skip calls it is confident about and keep it trained",
+    )
+    parser.add_argument(
+        "--anomalies",
+        type=str,
+        default=None,
+        help="Anomaly detector state file (anomaly_detector.py); check each tick against its baseline",
+    )
+    parser.add_argument(
+        "--anomaly-log",
+        type=str,
+        default=None,
+        help="Append anomaly events to this JSONL file (default: stdout)",
+    )
+    parser.add_argument(
+        "--anomaly-save-every",
+        type=int,
+        default=None,
+        help="Save the anomaly state every N ticks and on exit (default: anomaly_detector.SAVE_EVERY_TICKS)",
+    )
     return parser.parse_args()
 
 
@@ -162,20 +320,66 @@ def main():
         missed = int(((now - start_dt).total_seconds() // interval.total_seconds()) + 1)
         next_run = start_dt + timedelta(seconds=missed * interval.total_seconds())
 
-    t = 1
-    while next_run <= end_dt:
-        now = datetime.now()
-        sleep_seconds = (next_run - now).total_seconds()
-        if sleep_seconds > 0:
-            time.sleep(sleep_seconds)
-        output = run_script()
-        data = parse_output(output)
-        log_to_excel(data)
-        print(
-            f"Round {t}: Logged at {data['timestamp']} ({args.start} to {args.end} / per {args.interval_minutes} minutes {args.interval_seconds} seconds): {data}"
+    model = None
+    corridor = None
+    last = None
+    if args.predictor:
+        from predictor import DelayPredictor
+
+        model = DelayPredictor.load(args.predictor) if os.path.exists(args.predictor) else DelayPredictor()
+
+    detector = None
+    if args.anomalies:
+        from anomaly_detector import SAVE_EVERY_TICKS, AnomalyDetector
+
+        detector = (
+            AnomalyDetector.load(args.anomalies)
+            if os.path.exists(args.anomalies)
+            else AnomalyDetector()
         )
-        next_run += interval
-        t += 1
+        save_every = args.anomaly_save_every or SAVE_EVERY_TICKS
+
+    t = 1
+    try:
+        while next_run <= end_dt:
+            now = datetime.now()
+            sleep_seconds = (next_run - now).total_seconds()
+            if sleep_seconds > 0:
+                time.sleep(sleep_seconds)
+            prediction = predicted_skip(model, corridor) if last is not None else None
+            if prediction is not None:
+                # Logged like a real tick so the log keeps its cadence; not learned from
+                data = predicted_row(prediction, last)
+                log_to_excel(data)
+                if args.store:
+                    log_to_store(data, args.store)
+                print(
+                    f"Round {t}: Skipped API call, logged prediction {data['duration_with_traffic']:.2f} min "
+                    f"({data['difference_percent']:+.1f}%)"
+                )
+                next_run += interval
+                t += 1
+                continue
+            output = run_script(args.coords)
+            data = parse_output(output, args.coords)
+            log_to_excel(data)
+            if args.store:
+                log_to_store(data, args.store)
+            if model is not None:
+                corridor = learn_tick(model, data, args.predictor) or corridor
+                if data["duration_with_traffic"] is not None:
+                    last = data
+            if detector is not None:
+                detect_anomalies(detector, data, args.anomalies if t % save_every == 0 else None, args.anomaly_log)
+            print(
+                f"Round {t}: Logged at {data['timestamp']} ({args.start} to {args.end} / per {args.interval_minutes} minutes {args.interval_seconds} seconds): {data}"
+            )
+            next_run += interval
+            t += 1
+    finally:
+        if detector is not None:
+            # The state is only saved every few ticks; keep the rest on exit (also on Ctrl+C)
+            detector.save(args.anomalies)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,294 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# =========================
+# TEDS 12.0 future-year projection
+# =========================
+# Loads the TEDS 12.0 "歷年未來年" tables (ROC years 97-119, tonnes/year) into
+# indexed arrays and evaluates scenario sweeps over county x year x scenario
+# in one vectorised pass. Fractional and in-between years are linearly
+# interpolated; years outside the table are clamped to the first/last year.
+#
+# A scenario is a name plus per-source multipliers, and optionally a
+# congestion reduction (0-1) that is turned into a line-source multiplier
+# using the excess-emission share measured from our probe logs.
+#
+# Usage:
+#   python teds_projection.py --years 2025 2030 2035 --scenarios scenarios.json --out sweep.csv
+#
+# scenarios.json:
+#   [{"name": "baseline"},
+#    {"name": "less_congestion", "congestion_reduction": 0.5},
+#    {"name": "ev_push", "multipliers": {"line": 0.8}}]
+
+TEDS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "空氣污染物排放量清冊TEDS12.0版相關文件",
+)
+COUNTY_TABLE = os.path.join(TEDS_DIR, "TEDS12.0-縣市歷年未來年.ods")
+NATIONAL_TABLE = os.path.join(TEDS_DIR, "TEDS12.0-全國歷年未來年.ods")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".teds_cache")
+
+# Sheet / row labels -> source keys. 總計 rows and the all-source sheet are
+# dropped because they are sums of the others.
+SOURCES = {"點源": "point", "線源": "line", "面源": "area", "非公路運輸": "nonroad"}
+TOTAL_LABEL = "總計"
+ROC_OFFSET = 1911
+
+
+def to_roc_year(years):
+    """Accept Gregorian (e.g. 2030) or ROC (e.g. 119) years, return ROC years."""
+    years = np.asarray(years, dtype=float)
+    return np.where(years > ROC_OFFSET, years - ROC_OFFSET, years)
+
+
+def _file_fingerprint(path):
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def _source_of(label):
+    for name, key in SOURCES.items():
+        if name in str(label):
+            return key
+    return None
+
+
+def _parse_block(sheet, label_col):
+    """
+    Parse one sheet laid out as pollutant (first column, blank below) x label rows
+    with ROC years across the header row. Returns {(pollutant, label): row values}.
+    """
+    header = sheet.iloc[2]
+    year_cols = [c for c in sheet.columns if isinstance(header[c], (int, float)) and not pd.isna(header[c])]
+    years = header[year_cols].astype(int).to_numpy()
+    pollutant = sheet[0].where(sheet[1].notna()).ffill()
+    rows = {}
+    for i in range(3, len(sheet)):
+        label = sheet.at[i, label_col]
+        if pd.isna(label) or pd.isna(pollutant[i]):
+            continue
+        values = pd.to_numeric(sheet.loc[i, year_cols], errors="coerce").to_numpy(dtype=float)
+        rows[(str(pollutant[i]).upper(), str(label))] = values
+    return years, rows
+
+
+def _parse_county_table(path):
+    sheets = pd.read_excel(path, engine="odf", sheet_name=None, header=None)
+    blocks = {}
+    years = None
+    for name, sheet in sheets.items():
+        source = _source_of(name)
+        if source is None:
+            continue
+        years, blocks[source] = _parse_block(sheet, 1)
+    sources = [s for s in SOURCES.values() if s in blocks]
+    keys = blocks[sources[0]].keys()
+    pollutants = list(dict.fromkeys(p for p, _ in keys))
+    counties = list(dict.fromkeys(c for _, c in keys if c != TOTAL_LABEL))
+    values = np.full((len(sources), len(pollutants), len(counties), len(years)), np.nan)
+    for s, source in enumerate(sources):
+        for (p, c), row in blocks[source].items():
+            if c != TOTAL_LABEL:
+                values[s, pollutants.index(p), counties.index(c)] = row
+    return {
+        "sources": np.array(sources),
+        "pollutants": np.array(pollutants),
+        "regions": np.array(counties),
+        "years": years,
+        "values": values,
+    }
+
+
+def _parse_national_table(path):
+    sheets = pd.read_excel(path, engine="odf", sheet_name=None, header=None)
+    regions = []
+    per_region = []
+    years = None
+    for name, sheet in sheets.items():
+        years, rows = _parse_block(sheet, 1)
+        regions.append("含金馬" if "含金馬" in name and "不含" not in name else "不含金馬")
+        per_region.append({(p, _source_of(label)): row for (p, label), row in rows.items() if _source_of(label)})
+    sources = list(SOURCES.values())
+    pollutants = list(dict.fromkeys(p for p, _ in per_region[0]))
+    values = np.full((len(sources), len(pollutants), len(regions), len(years)), np.nan)
+    for r, rows in enumerate(per_region):
+        for (p, source), row in rows.items():
+            values[sources.index(source), pollutants.index(p), r] = row
+    return {
+        "sources": np.array(sources),
+        "pollutants": np.array(pollutants),
+        "regions": np.array(regions),
+        "years": years,
+        "values": values,
+    }
+
+
+def load_table(path=COUNTY_TABLE, cache_dir=CACHE_DIR):
+    """
+    Load a TEDS table as arrays with values indexed [source, pollutant, region, year].
+    Parsing the .ods is slow, so the arrays are cached as .npz keyed by file size/mtime.
+    """
+    fingerprint = _file_fingerprint(path)
+    key = hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f"table_{key}.npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            table = {k: cached[k] for k in cached.files}
+    else:
+        parse = _parse_national_table if "全國" in os.path.basename(path) else _parse_county_table
+        table = parse(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_path, **table)
+    table["fingerprint"] = fingerprint
+    return table
+
+
+def interpolate_years(table, years):
+    """Linearly interpolate values along the year axis; returns [source, pollutant, region, len(years)]."""
+    target = to_roc_year(years)
+    known = table["years"].astype(float)
+    pos = np.interp(target, known, np.arange(len(known)))
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, len(known) - 1)
+    frac = pos - lo
+    values = np.nan_to_num(table["values"])
+    return values[..., lo] * (1 - frac) + values[..., hi] * frac
+
+
+def congestion_excess_share(df):
+    """
+    Share of on-road CO2 that is congestion excess, averaged over probe observations.
+    A congestion reduction r then scales line-source emissions by (1 - r * share).
+    """
+    from emission_hotspots import excess_emissions, co2_grams_per_km, haversine_m, STRAIGHT_LINE_DETOUR
+
+    straight_km = haversine_m(df["origin_lat"], df["origin_lng"], df["dest_lat"], df["dest_lng"]) / 1000
+    length_km = df["distance_km"].fillna(pd.Series(straight_km * STRAIGHT_LINE_DETOUR, index=df.index))
+    total = length_km * co2_grams_per_km(length_km / (df["duration_with_traffic"] / 60))
+    share = excess_emissions(df) / total
+    share = share[np.isfinite(share)]
+    return float(share.mean()) if len(share) else 0.0
+
+
+def scenario_multipliers(scenarios, sources, excess_share=0.0):
+    """[scenario, source] multiplier matrix."""
+    sources = list(sources)
+    m = np.ones((len(scenarios), len(sources)))
+    for i, scenario in enumerate(scenarios):
+        for source, factor in scenario.get("multipliers", {}).items():
+            m[i, sources.index(source)] *= factor
+        reduction = scenario.get("congestion_reduction", 0.0)
+        if reduction and "line" in sources:
+            m[i, sources.index("line")] *= 1 - reduction * excess_share
+    return m
+
+
+def evaluate(table, scenarios, years, excess_share=0.0):
+    """Emissions [scenario, pollutant, region, year] for every combination in one pass."""
+    base = interpolate_years(table, years)
+    m = scenario_multipliers(scenarios, table["sources"], excess_share)
+    return np.einsum("ks,sprt->kprt", m, base)
+
+
+def _scenario_key(scenario, table, years, excess_share):
+    payload = json.dumps(
+        {
+            "scenario": scenario,
+            "table": table["fingerprint"],
+            "years": [float(y) for y in years],
+            "excess_share": round(excess_share, 9),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def run_sweep(table, scenarios, years, excess_share=0.0, cache_dir=CACHE_DIR):
+    """
+    Evaluate a scenario sweep, reusing cached results. Only scenarios whose
+    definition (or the table / years / excess share) changed are recomputed,
+    and those are still evaluated together in one vectorised call.
+    """
+    keys = [_scenario_key(s, table, years, excess_share) for s in scenarios]
+    paths = [os.path.join(cache_dir, f"scenario_{k}.npy") for k in keys]
+    missing = [i for i, p in enumerate(paths) if not os.path.exists(p)]
+
+    results = [None] * len(scenarios)
+    if missing:
+        fresh = evaluate(table, [scenarios[i] for i in missing], years, excess_share)
+        os.makedirs(cache_dir, exist_ok=True)
+        for j, i in enumerate(missing):
+            np.save(paths[i], fresh[j])
+            results[i] = fresh[j]
+    for i, path in enumerate(paths):
+        if results[i] is None:
+            results[i] = np.load(path)
+    return np.stack(results), len(missing)
+
+
+def to_frame(result, table, scenarios, years):
+    """Long-format DataFrame of a sweep result."""
+    names = [s.get("name", f"scenario_{i}") for i, s in enumerate(scenarios)]
+    index = pd.MultiIndex.from_product(
+        [names, table["pollutants"], table["regions"], list(years)],
+        names=["scenario", "pollutant", "region", "year"],
+    )
+    return pd.DataFrame({"emissions_t": result.ravel()}, index=index).reset_index()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Project TEDS 12.0 emissions for county x year x scenario sweeps."
+    )
+    parser.add_argument("--table", default=COUNTY_TABLE, help="TEDS .ods table")
+    parser.add_argument(
+        "--years", type=float, nargs="+", required=True, help="Years (Gregorian or ROC, fractional allowed)"
+    )
+    parser.add_argument("--scenarios", help="JSON file with a list of scenarios")
+    parser.add_argument(
+        "--probe-logs",
+        action="store_true",
+        help="Derive the congestion excess share from Data/route_log_*.xlsx",
+    )
+    parser.add_argument("--pollutant", help="Only output this pollutant (e.g. NOX)")
+    parser.add_argument("--out", default="teds_sweep.csv", help="Output CSV")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    table = load_table(args.table)
+    if args.scenarios:
+        with open(args.scenarios, encoding="utf-8") as f:
+            scenarios = json.load(f)
+    else:
+        scenarios = [{"name": "baseline"}]
+
+    excess_share = 0.0
+    if args.probe_logs:
+        from route_logs import load_route_logs
+
+        excess_share = congestion_excess_share(load_route_logs())
+        print(f"Congestion excess share from probe logs: {excess_share:.3f}")
+
+    result, recomputed = run_sweep(table, scenarios, args.years, excess_share)
+    df = to_frame(result, table, scenarios, args.years)
+    if args.pollutant:
+        df = df[df["pollutant"] == args.pollutant.upper()]
+    df.to_csv(args.out, index=False)
+    print(
+        f"{len(scenarios)} scenarios x {len(table['regions'])} regions x {len(args.years)} years "
+        f"({recomputed} recomputed) -> {args.out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import compact_store
+import observation_store as store_lib
+import route_query
+
+# Every DSL shape against a small store, checked against plain pandas.
+#   python -m pytest test_route_query.py
+
+CORRIDORS = ["25.0808,121.5651>25.0688,121.5843", "25.0500,121.5000>25.0400,121.5200", "25.0300,121.5600>25.0100,121.5700"]
+
+
+@pytest.fixture(scope="module")
+def observations():
+    rng = np.random.default_rng(0)
+    ticks = pd.date_range("2025-10-01", "2025-10-10", freq="10min", inclusive="left")
+    df = pd.DataFrame(
+        {
+            "timestamp": np.repeat(ticks, len(CORRIDORS)),
+            "corridor": np.tile(CORRIDORS, len(ticks)),
+        }
+    )
+    df["duration_no_traffic"] = 600.0
+    df["difference_percent"] = rng.gamma(2.0, 10.0, len(df))
+    df.loc[rng.random(len(df)) < 0.05, "difference_percent"] = np.nan
+    df["duration_with_traffic"] = 600.0 * (1 + df["difference_percent"] / 100)
+    df["difference_seconds"] = df["duration_with_traffic"] - 600.0
+    df["distance_km"] = 3.2
+    df["congestion_class"] = np.digitize(df["difference_percent"], [10, 30, 60]).astype(np.int8)
+    return df
+
+
+@pytest.fixture(scope="module")
+def store(observations, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("store"))
+    store_lib.append(observations, path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def compacted(observations, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("compacted"))
+    store_lib.append(observations, path)
+    compact_store.compact(path, now="2025-10-20", retention={"raw": 1, "15min": 90, "hourly": 730, "daily": None})
+    return path
+
+
+def _expected(df, keys, column, func):
+    df = df.assign(
+        date=df["timestamp"].dt.normalize(), hour=df["timestamp"].dt.hour, weekday=df["timestamp"].dt.weekday
+    )
+    values = df[column].groupby([df[k] for k in keys]) if keys else df[column]
+    if func.startswith("p"):
+        return values.quantile(int(func[1:]) / 100)
+    return getattr(values, func)()
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "p90(difference_percent)",
+        "count(*)",
+        "mean(difference_percent) by corridor",
+        "p90(difference_percent) by weekday, hour",
+        "median(difference_percent), count(difference_percent) by date",
+        "min(duration_with_traffic), max(duration_with_traffic), sum(difference_seconds) by corridor, hour",
+        "count(*) by congestion_class",
+    ],
+)
+def test_dsl_shapes(store, observations, expression):
+    aggs, keys, _ = route_query.parse_dsl(expression)
+    result = route_query.run_dsl(expression, store)
+    for func, column in aggs:
+        name = f"{func}({column or '*'})"
+        expected = _expected(observations, keys, column or "timestamp", func)
+        if keys:
+            got = result.set_index(keys)[name]
+            assert len(got) == len(expected)
+            np.testing.assert_allclose(got.to_numpy(float), expected.to_numpy(float))
+        else:
+            assert result[name].iloc[0] == pytest.approx(expected)
+
+
+def test_dsl_where(store, observations):
+    corridor = CORRIDORS[1]
+    result = route_query.run_dsl(
+        f"p95(difference_percent) by hour where corridor = '{corridor}' "
+        "and timestamp >= '2025-10-03' and timestamp < '2025-10-05' and difference_percent > 20",
+        store,
+    )
+    df = observations
+    df = df[
+        (df["corridor"] == corridor)
+        & (df["timestamp"] >= "2025-10-03")
+        & (df["timestamp"] < "2025-10-05")
+        & (df["difference_percent"] > 20)
+    ]
+    expected = df.groupby(df["timestamp"].dt.hour)["difference_percent"].quantile(0.95)
+    np.testing.assert_allclose(result["p95(difference_percent)"], expected.to_numpy())
+
+
+def test_dsl_where_derived_keys(store, observations):
+    result = route_query.run_dsl(
+        "count(*) by corridor where hour >= 7 and hour < 9 and weekday != 5 and date <= '2025-10-06'", store
+    )
+    ts = observations["timestamp"]
+    df = observations[(ts.dt.hour >= 7) & (ts.dt.hour < 9) & (ts.dt.weekday != 5) & (ts < "2025-10-07")]
+    expected = df.groupby("corridor").size()
+    assert len(result) == len(CORRIDORS)
+    np.testing.assert_array_equal(result.set_index("corridor")["count(*)"], expected[result["corridor"]])
+
+
+@pytest.mark.parametrize(
+    "expression", ["count(*) where difference_pct > 20", "mean(difference_pct)", "count(*) by lane"]
+)
+def test_dsl_unknown_column(store, expression):
+    with pytest.raises(ValueError, match="Unknown column"):
+        route_query.run_dsl(expression, store)
+
+
+def test_pandas_fallback_matches(store, monkeypatch):
+    expression = "p90(difference_percent), mean(difference_percent), count(*) by corridor, date"
+    fast = route_query.run_dsl(expression, store)
+    monkeypatch.setattr(route_query, "FAST_GROUPS", 0)
+    slow = route_query.run_dsl(expression, store)
+    pd.testing.assert_frame_equal(
+        fast.astype({"corridor": str}), slow.astype({"corridor": str}), check_dtype=False
+    )
+
+
+def test_rollup_tier(compacted, observations):
+    result = route_query.run_dsl("sum(count) by corridor", compacted, tier="hourly")
+    assert result["sum(count)"].sum() == len(observations)
+    result = route_query.run_dsl("mean(difference_percent_p90) by corridor", compacted, tier="hourly")
+    assert len(result) == len(CORRIDORS)
+
+
+def test_sql_on_rollup_tier(compacted, observations):
+    result = route_query.run_sql("SELECT corridor, SUM(count) AS n FROM logs GROUP BY corridor", compacted, tier="hourly")
+    assert result["n"].sum() == len(observations)
+    result = route_query.run_sql("SELECT hour, percentile(difference_percent, 90) AS p90 FROM logs GROUP BY hour", compacted)
+    assert len(result) == 0  # raw tier was rolled up and dropped
+
+
+def test_sql_loads_named_columns(store, observations):
+    assert route_query.sql_columns("SELECT hour, AVG(difference_percent) FROM logs GROUP BY hour", store) == [
+        "difference_percent",
+        "hour",
+    ]
+    assert route_query.sql_columns("SELECT COUNT(*) FROM logs", store) == ["timestamp"]
+    assert "distance_km" in route_query.sql_columns("SELECT * FROM logs", store)
+    result = route_query.run_sql("SELECT weekday, COUNT(*) AS n FROM logs GROUP BY weekday", store)
+    assert list(result["n"]) == list(observations.groupby(observations["timestamp"].dt.weekday).size())
+    assert len(route_query.run_sql("SELECT * FROM logs LIMIT 3", store).columns) == len(
+        route_query.sql_columns("SELECT *", store)
+    )
@@ -0,0 +1,141 @@
+import datetime
+import math
+import os
+import sys
+import time
+
+PROGRAM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Program")
+sys.path.insert(0, PROGRAM_DIR)
+
+from google.maps.routing_v2.types import (  # noqa: E402
+    ComputeRoutesResponse,
+    Location,
+    Route,
+    RouteLeg,
+    RouteTravelAdvisory,
+    RoutingPreference,
+    SpeedReadingInterval,
+)
+from google.protobuf.duration_pb2 import Duration  # noqa: E402
+
+# =========================
+# Synthetic Routes API responder
+# =========================
+# Stands in for RoutesClient so the probe-to-log pipeline runs offline.
+# Answers are deterministic in (OD, time of day): distance from the straight
+# line x 1.3, free flow at 30 km/h, a morning and an evening peak on top for
+# TRAFFIC_AWARE requests, a straight-line polyline and speed intervals.
+# Intermediates split the route into legs, each with duration and static
+# duration, like the real API.
+#
+# Run as a script it is a drop-in for routes_congestion_v2_grpc.py
+# (same arguments, same output), which is what run_script() launches in the
+# benchmarks:
+#   python benchmarks/responder.py [olat olng [ilat ilng ...] dlat dlng]
+
+POLYLINE_POINTS = 50
+FREE_FLOW_KMH = 30.0
+
+
+def _encode_polyline(points):
+    """Google polyline encoding; kept here (not route_geometry) so the drop-in does not import pandas."""
+    out = []
+    previous = (0, 0)
+    for lat, lng in points:
+        current = (int(round(lat * 1e5)), int(round(lng * 1e5)))
+        for value in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        previous = current
+    return "".join(out)
+
+
+def _peak_factor(when):
+    hour = when.hour + when.minute / 60
+    return 1 + 0.8 * math.exp(-(((hour - 8.5) / 1.2) ** 2)) + 0.9 * math.exp(-(((hour - 18) / 1.5) ** 2))
+
+
+def _km(a, b):
+    dlat = math.radians(b[0] - a[0])
+    dlng = math.radians(b[1] - a[1])
+    h = math.sin(dlat / 2) ** 2 + math.cos(math.radians(a[0])) * math.cos(math.radians(b[0])) * math.sin(dlng / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(h)) * 1.3
+
+
+def _point(waypoint):
+    lat_lng = waypoint.location.lat_lng
+    return (lat_lng.latitude, lat_lng.longitude)
+
+
+def _location(point):
+    return Location(lat_lng={"latitude": point[0], "longitude": point[1]})
+
+
+class SyntheticRoutesClient:
+    """compute_routes() with the RoutesClient signature; latency adds a fixed sleep per call."""
+
+    def __init__(self, latency=0.0, clock=datetime.datetime.now):
+        self.latency = latency
+        self.clock = clock
+        self.calls = 0
+
+    def compute_routes(self, request, metadata=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        points = [_point(request.origin)] + [_point(w) for w in request.intermediates] + [_point(request.destination)]
+        factor = 1.0
+        if request.routing_preference == RoutingPreference.TRAFFIC_AWARE:
+            factor = _peak_factor(self.clock())
+
+        legs = []
+        for a, b in zip(points, points[1:]):
+            km = _km(a, b)
+            static = int(round(km / FREE_FLOW_KMH * 3600))
+            legs.append(
+                RouteLeg(
+                    start_location=_location(a),
+                    end_location=_location(b),
+                    distance_meters=int(km * 1000),
+                    duration=Duration(seconds=int(round(static * factor))),
+                    static_duration=Duration(seconds=static),
+                )
+            )
+        path = [
+            (points[0][0] + (points[-1][0] - points[0][0]) * i / (POLYLINE_POINTS - 1),
+             points[0][1] + (points[-1][1] - points[0][1]) * i / (POLYLINE_POINTS - 1))
+            for i in range(POLYLINE_POINTS)
+        ]
+        slow = SpeedReadingInterval.Speed.SLOW if factor > 1.3 else SpeedReadingInterval.Speed.NORMAL
+        advisory = RouteTravelAdvisory(
+            speed_reading_intervals=[
+                SpeedReadingInterval(start_polyline_point_index=0, end_polyline_point_index=POLYLINE_POINTS // 2,
+                                     speed=SpeedReadingInterval.Speed.NORMAL),
+                SpeedReadingInterval(start_polyline_point_index=POLYLINE_POINTS // 2,
+                                     end_polyline_point_index=POLYLINE_POINTS - 1, speed=slow),
+            ]
+        )
+        route = Route(
+            legs=legs,
+            distance_meters=sum(leg.distance_meters for leg in legs),
+            duration=Duration(seconds=sum(leg.duration.seconds for leg in legs)),
+            static_duration=Duration(seconds=sum(leg.static_duration.seconds for leg in legs)),
+            polyline={"encoded_polyline": _encode_polyline(path)},
+            travel_advisory=advisory,
+        )
+        return ComputeRoutesResponse(routes=[route])
+
+
+def main():
+    import routes_congestion_v2_grpc as probe
+
+    probe.RoutesClient = SyntheticRoutesClient
+    probe.API_KEY = "synthetic"
+    probe.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from responder import SyntheticRoutesClient  # noqa: E402  (also puts Program/ on sys.path)
+
+import pandas as pd  # noqa: E402
+
+import observation_store  # noqa: E402
+import routes_congestion_v2_grpc as probe  # noqa: E402
+import run_and_log_routes as logger  # noqa: E402
+from anomaly_detector import SAVE_EVERY_TICKS, AnomalyDetector  # noqa: E402
+from predictor import DelayPredictor  # noqa: E402
+from route_logs import normalise_log  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# =========================
+# Probe-to-log pipeline benchmarks
+# =========================
+# Runs offline against the synthetic responder (responder.py):
+#
+#   tick     per-tick latency by stage: run_script() subprocess, the same probe
+#            in process, parse_output(), log_to_excel(), store append,
+#            anomaly check (saving the state every SAVE_EVERY_TICKS, as the
+#            logger does), predictor update
+#   scaling  in-process tick time for 1 .. 10k corridors, including the
+#            anomaly state save amortised over SAVE_EVERY_TICKS
+#   append   log_to_excel() / store append cost against existing log size
+#   memory   traced Python memory over a simulated multi-day run
+#
+# Every metric is "lower is better" (ms or MB) and is written to JSON. Timings
+# are reported as median / p90 / min over the repeats. Only the min (best of
+# N: load from other processes only ever adds time) and memory are gated:
+# with a baseline, those more than --threshold and MIN_DELTA above it are
+# reported as regressions and the exit code is 1. A regression is only
+# reported after --confirm re-runs of its suite still show it (each metric
+# keeps its best value over the runs): on a shared machine a whole run can be
+# 20-70% slower than the next one. For the same reason --update-baseline runs
+# the suites 1 + --confirm times and records the median of each gated metric.
+#
+# Baselines are per machine and are not committed: record one locally with
+# --update-baseline (same --quick setting) before the gate means anything. The
+# default baseline is only gated when it was recorded on this host; an
+# explicit --baseline path or --gate gates whatever the hostname (CI and
+# containers, where hostnames change between runs). Ungated runs report the
+# differences without the confirm re-runs.
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py --quick --update-baseline
+#   python benchmarks/run_benchmarks.py --quick --threshold 0.25
+#   python benchmarks/run_benchmarks.py --quick --baseline ci/baseline.json
+
+RESPONDER = os.path.join(BENCH_DIR, "responder.py")
+RESULTS_FILE = os.path.join(BENCH_DIR, "results", "latest.json")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+THRESHOLD = 0.25
+CONFIRM_RUNS = 2
+# Ignore smaller differences, they are run-to-run noise (the ~15 ms stages are
+# mostly file writes and vary by several ms on a busy machine)
+MIN_DELTA = {"_ms": 5.0, "_mb": 1.0}
+GATED = (".min_ms", "_mb")  # medians and p90 move with machine load; reported, not gated
+SUITES = ["tick", "scaling", "append", "memory"]
+
+ORIGIN = (25.080835, 121.565052)
+
+
+def corridor_points(n):
+    """n distinct synthetic OD pairs around the default corridor."""
+    return [
+        ((ORIGIN[0] + 0.001 * (i % 100), ORIGIN[1] + 0.001 * (i // 100)),
+         (ORIGIN[0] - 0.012 + 0.001 * (i % 100), ORIGIN[1] + 0.019 + 0.001 * (i // 100)))
+        for i in range(n)
+    ]
+
+
+def probe_output(client, origin, destination):
+    """The probe's stdout for one corridor, produced in process."""
+    result = probe.compute_congestion(
+        client, probe.build_waypoint(*origin), probe.build_waypoint(*destination), []
+    )
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        probe.print_result(result)
+    return buffer.getvalue()
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    value = fn(*args)
+    return (time.perf_counter() - t0) * 1000, value
+
+
+def _summary(samples):
+    return {
+        "median": statistics.median(samples),
+        "p90": sorted(samples)[int(0.9 * (len(samples) - 1))],
+        "min": min(samples),
+    }
+
+
+def _stage_metrics(prefix, stages):
+    """prefix.stage.{median,p90,min}_ms for every stage's samples."""
+    return {
+        f"{prefix}.{name}.{stat}_ms": value
+        for name, samples in stages.items()
+        for stat, value in _summary(samples).items()
+    }
+
+
+def bench_tick(workdir, ticks=20):
+    """Per-stage latency of one logger tick, in ms."""
+    logger.SCRIPT_PATH = RESPONDER
+    logger.EXCEL_PATH = os.path.join(workdir, "tick_log.xlsx")
+    store = os.path.join(workdir, "tick_store")
+    detector = AnomalyDetector()
+    model = DelayPredictor()
+    client = SyntheticRoutesClient()
+    stages = {name: [] for name in ["run_script", "probe_in_process", "parse_output", "log_to_excel",
+                                    "store_append", "anomaly_check", "predictor_update"]}
+    for t in range(1, ticks + 1):
+        ms, output = _timed(logger.run_script)
+        stages["run_script"].append(ms)
+        stages["probe_in_process"].append(_timed(probe_output, client, ORIGIN, probe.DEFAULT_DESTINATION)[0])
+        ms, data = _timed(logger.parse_output, output)
+        stages["parse_output"].append(ms)
+        stages["log_to_excel"].append(_timed(logger.log_to_excel, data)[0])
+        stages["store_append"].append(_timed(logger.log_to_store, data, store)[0])
+        stages["anomaly_check"].append(
+            _timed(
+                logger.detect_anomalies, detector, data,
+                os.path.join(workdir, "anomaly.npz") if t % SAVE_EVERY_TICKS == 0 else None, os.devnull,
+            )[0]
+        )
+        stages["predictor_update"].append(
+            _timed(logger.learn_tick, model, data, os.path.join(workdir, "predictor.npz"))[0]
+        )
+    metrics = _stage_metrics("tick", stages)
+    for stat in ("median", "min"):
+        metrics[f"tick.total.{stat}_ms"] = sum(
+            metrics[f"tick.{name}.{stat}_ms"] for name in stages if name != "probe_in_process"
+        )
+    return metrics
+
+
+def bench_scaling(workdir, counts=(1, 10, 100, 1000, 10000), ticks=3):
+    """In-process tick time (probe + parse + normalise + store + anomaly check and save) by corridor count, in ms."""
+    client = SyntheticRoutesClient()
+    metrics = {}
+    for n in counts:
+        points = corridor_points(n)
+        store = os.path.join(workdir, f"scaling_store_{n}")
+        detector = AnomalyDetector()
+        stages = {"probe": [], "parse": [], "normalise": [], "store_append": [], "anomaly_check": [], "anomaly_save": []}
+        for _ in range(ticks):
+            t0 = time.perf_counter()
+            outputs = [probe_output(client, o, d) for o, d in points]
+            t1 = time.perf_counter()
+            rows = [logger.parse_output(text) for text in outputs]
+            t2 = time.perf_counter()
+            df = normalise_log(pd.DataFrame(rows)).assign(
+                corridor=[f"{o[0]:.4f},{o[1]:.4f}>{d[0]:.4f},{d[1]:.4f}" for o, d in points]
+            )
+            t3 = time.perf_counter()
+            observation_store.append(df, store)
+            t4 = time.perf_counter()
+            detector.observe(df["corridor"], df["timestamp"], df["difference_percent"])
+            t5 = time.perf_counter()
+            detector.save(os.path.join(workdir, f"scaling_anomaly_{n}.npz"))
+            t6 = time.perf_counter()
+            for name, (a, b) in zip(stages, [(t0, t1), (t1, t2), (t2, t3), (t3, t4), (t4, t5), (t5, t6)]):
+                stages[name].append((b - a) * 1000)
+            stages["anomaly_save"][-1] /= SAVE_EVERY_TICKS  # the logger saves once per SAVE_EVERY_TICKS
+        metrics.update(_stage_metrics(f"scaling.{n}", stages))
+        for stat in ("median", "min"):
+            metrics[f"scaling.{n}.tick.{stat}_ms"] = sum(metrics[f"scaling.{n}.{name}.{stat}_ms"] for name in stages)
+    return metrics
+
+
+def bench_append(workdir, sizes=(0, 500, 2016, 8640), repeats=3):
+    """Cost of appending one tick to an Excel log / the store that already holds size rows, in ms."""
+    client = SyntheticRoutesClient()
+    data = logger.parse_output(probe_output(client, ORIGIN, probe.DEFAULT_DESTINATION))
+    metrics = {}
+    for size in sizes:
+        path = os.path.join(workdir, f"append_{size}.xlsx")
+        if size:
+            pd.DataFrame([data] * size).to_excel(path, index=False)
+        store = os.path.join(workdir, f"append_store_{size}")
+        if size:
+            observation_store.append(normalise_log(pd.DataFrame([data] * size)), store)
+        logger.EXCEL_PATH = path
+        excel, parts = [], []
+        for _ in range(repeats):
+            excel.append(_timed(logger.log_to_excel, data)[0])
+            parts.append(_timed(logger.log_to_store, data, store)[0])
+        metrics.update(_stage_metrics(f"append.{size}_rows", {"excel": excel, "store": parts}))
+    return metrics
+
+
+def bench_memory(workdir, days=7, corridors=10, interval_minutes=5):
+    """Traced Python memory while ticking corridors for days of simulated time, in MB."""
+    start = datetime.datetime(2025, 10, 6)
+    now = {"t": start}
+    client = SyntheticRoutesClient(clock=lambda: now["t"])
+    points = corridor_points(corridors)
+    keys = [f"{o[0]:.4f},{o[1]:.4f}>{d[0]:.4f},{d[1]:.4f}" for o, d in points]
+    store = os.path.join(workdir, "memory_store")
+    detector = AnomalyDetector()
+    model = DelayPredictor()
+    ticks_per_day = 24 * 60 // interval_minutes
+
+    tracemalloc.start()
+    daily = []
+    for tick in range(days * ticks_per_day):
+        now["t"] = start + datetime.timedelta(minutes=interval_minutes * tick)
+        rows = [logger.parse_output(probe_output(client, o, d)) for o, d in points]
+        df = normalise_log(pd.DataFrame(rows)).assign(
+            timestamp=pd.Timestamp(now["t"]), corridor=keys
+        )
+        observation_store.append(df, store)
+        detector.observe(df["corridor"], df["timestamp"], df["difference_percent"])
+        model.update(df)
+        if (tick + 1) % ticks_per_day == 0:
+            daily.append(tracemalloc.get_traced_memory()[0] / 2**20)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    metrics = {
+        "memory.final_traced_mb": daily[-1],
+        "memory.peak_traced_mb": peak,
+        "memory.growth_after_day1_mb": daily[-1] - daily[0],
+    }
+    if resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        scale = 2**20 if sys.platform == "darwin" else 2**10
+        metrics["memory.max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return metrics, {"traced_mb_by_day": daily}
+
+
+def compare(metrics, baseline, threshold=THRESHOLD, min_delta=MIN_DELTA):
+    """Metrics that got worse than the baseline by more than threshold and the unit's min_delta."""
+    regressions = []
+    for name, value in metrics.items():
+        base = baseline.get(name)
+        if base is None or not name.endswith(GATED):
+            continue
+        floor = next((delta for unit, delta in min_delta.items() if name.endswith(unit)), 0.0)
+        if value > base * (1 + threshold) and value - base > floor:
+            regressions.append({"metric": name, "baseline": base, "value": value, "change": value / base - 1 if base else None})
+    return regressions
+
+
+def run(suites, quick=False):
+    workdir = tempfile.mkdtemp(prefix="route_bench_")
+    metrics, details = {}, {}
+    try:
+        if "tick" in suites:
+            metrics.update(bench_tick(workdir, ticks=15 if quick else 40))
+        if "scaling" in suites:
+            counts = (1, 10, 100, 1000) if quick else (1, 10, 100, 1000, 10000)
+            metrics.update(bench_scaling(workdir, counts, ticks=3 if quick else 5))
+        if "append" in suites:
+            sizes = (0, 500, 2016) if quick else (0, 500, 2016, 8640)
+            metrics.update(bench_append(workdir, sizes, repeats=7))
+        if "memory" in suites:
+            memory, details["memory"] = bench_memory(workdir, days=2 if quick else 7)
+            metrics.update(memory)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return metrics, details
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the probe-to-log pipeline.")
+    parser.add_argument("--suite", nargs="+", choices=SUITES, default=SUITES, help="Suites to run")
+    parser.add_argument("--quick", action="store_true", help="Fewer ticks, up to 1k corridors, 2 simulated days")
+    parser.add_argument("--out", default=RESULTS_FILE, help="Results JSON")
+    parser.add_argument(
+        "--baseline", help=f"Baseline JSON to compare against and gate on (default: {BASELINE_FILE}, gated on its host only)"
+    )
+    parser.add_argument("--gate", action="store_true", help="Gate on the baseline even if another host recorded it")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Allowed relative slowdown")
+    parser.add_argument(
+        "--confirm", type=int, default=CONFIRM_RUNS,
+        help="Re-runs of a suite before a regression counts (and extra runs for --update-baseline)",
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline")
+    return parser.parse_args()
+
+
+def confirm(metrics, baseline, suites, quick, threshold=THRESHOLD, runs=CONFIRM_RUNS):
+    """Re-run the suites of regressed metrics, keeping the best value of each; returns the regressions left."""
+    regressions = compare(metrics, baseline, threshold)
+    for attempt in range(runs):
+        if not regressions:
+            break
+        rerun = [s for s in suites if any(r["metric"].split(".")[0] == s for r in regressions)]
+        print(f"Confirming {len(regressions)} regression(s): re-running {', '.join(rerun)} ({attempt + 1}/{runs})")
+        again, _ = run(rerun, quick)
+        for name, value in again.items():
+            if name.endswith(GATED):
+                metrics[name] = min(metrics.get(name, value), value)
+        regressions = compare(metrics, baseline, threshold)
+    return regressions
+
+
+def typical(metrics, suites, quick, runs=CONFIRM_RUNS):
+    """Gated metrics as the median over 1 + runs runs (the first run's values are in metrics)."""
+    samples = {name: [value] for name, value in metrics.items() if name.endswith(GATED)}
+    for attempt in range(runs):
+        print(f"Baseline run {attempt + 2}/{runs + 1}")
+        again, _ = run(suites, quick)
+        for name in samples:
+            samples[name].append(again[name])
+    return {**metrics, **{name: statistics.median(values) for name, values in samples.items()}}
+
+
+def main():
+    args = parse_args()
+    metrics, details = run(args.suite, args.quick)
+    if args.update_baseline:
+        metrics = typical(metrics, args.suite, args.quick, args.confirm)
+    baseline_file = args.baseline or BASELINE_FILE
+    baseline = None
+    if not args.update_baseline and os.path.exists(baseline_file):
+        with open(baseline_file, encoding="utf-8") as f:
+            baseline = json.load(f)
+        gated = args.gate or args.baseline is not None or baseline["meta"].get("machine") == platform.node()
+        if gated:
+            regressions = confirm(metrics, baseline["metrics"], args.suite, args.quick, args.threshold, args.confirm)
+        else:
+            regressions = compare(metrics, baseline["metrics"], args.threshold)
+    results = {
+        "meta": {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.node(),
+            "quick": args.quick,
+        },
+        "metrics": metrics,
+        "details": details,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    for name, value in metrics.items():
+        print(f"{name:45s} {value:12.3f}")
+    print(f"Results written to {args.out}")
+
+    if args.update_baseline:
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline updated: {baseline_file}")
+        return
+    if baseline is None:
+        print("No baseline to compare against (run with --update-baseline).")
+        return
+    if baseline["meta"].get("quick") != args.quick:
+        print("Warning: baseline and this run differ in --quick, some metrics are not comparable.")
+    for r in regressions:
+        print(f"REGRESSION {r['metric']}: {r['baseline']:.3f} -> {r['value']:.3f} (+{100 * r['change']:.0f}%)")
+    if not gated:
+        print(
+            f"Baseline was recorded on {baseline['meta'].get('machine', 'another machine')!r}, not gating. "
+            "Record a local one with --update-baseline, or pass --gate / --baseline."
+        )
+        return
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions above {100 * args.threshold:.0f}% against {baseline_file}")
+
+
+if __name__ == "__main__":
+    main()